@@ -0,0 +1,119 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the keyword dispatch of log lines with trying every event pattern on every line.
+
+Usage: python benchmarks/parse_lines.py [logfile]
+Without a logfile a synthetic log with a typical mix of events is used.
+"""
+import random
+import re
+import sys
+from collections import OrderedDict
+from time import perf_counter
+
+from dplib.logfile import iter_lines
+from dplib.server import EVENT_PATTERNS, LINES, LineDispatcher
+
+PREFIX = '^\\[\d\d:\d\d:\d\d\\] '
+
+# How a busy elim/CTF server's log looks, weights are rough counts per 100 lines
+MIX = [
+    (30, '*{n1} ({gun}) eliminated *{n2} ({gun}).'),
+    (22, '*{team}\'s {n1} revived!'),
+    (14, '{n1}: {msg}'),
+    (3, '[OBS] {n1}: {msg}'),
+    (4, '*{n1} got the *{team} flag!'),
+    (3, '*{n1} dropped the flag!'),
+    (2, '*{team}\'s {n1} returned the *{team} flag!'),
+    (2, 'Round started...'),
+    (2, '{team} team wins the round!'),
+    (2, '{n1} entered the game (build 41) [127.0.0.1:27901]'),
+    (2, '{n1} disconnected.'),
+    (2, '{n1} joined the *{team} team.'),
+    (1, '{n1} changed name to {n2}.'),
+    (1, '*{n1} eliminated himself with a paintgren.'),
+    (1, '*{team}\'s {n1} earned 3 points for possesion of eliminated teams flag!'),
+    (1, '\t\tGameEnd\t1032.6\tRed:23,Blue:22'),
+    (1, '== Map Loaded: airtime =='),
+    (1, '=== Team Flag CTF ==='),
+    (6, 'Ignoring unknown command: {msg}'),
+]
+NICKS = ['mRokita', 'hTml', 'whoa', '|ACEBot_1|', 'DPBot01', 'ph3nom', 'x-[ ]-x', 'Bob the Builder']
+GUNS = ['Spyder SE', 'Automag', 'PGP', 'Tippmann 98', 'Carbine']
+TEAMS = ['Red', 'Blue', 'Purple', 'Yellow']
+MESSAGES = ['gg', 'nice shot', 'lol', 'who has the flag?', 'rush mid!', 'brb', 'test: 1, 2, 3']
+
+
+def synthetic_log(count, seed=0):
+    rnd = random.Random(seed)
+    weights = [w for w, fmt in MIX]
+    formats = [fmt for w, fmt in MIX]
+    lines = []
+    for fmt in rnd.choices(formats, weights, k=count):
+        text = fmt.format(n1=rnd.choice(NICKS), n2=rnd.choice(NICKS), gun=rnd.choice(GUNS),
+                          team=rnd.choice(TEAMS), msg=rnd.choice(MESSAGES))
+        lines.append('[%02d:%02d:%02d] %s\n' % (rnd.randrange(24), rnd.randrange(60), rnd.randrange(60), text))
+    return lines
+
+
+def match_all(patterns, line):
+    """
+    The old way: every full-line pattern is searched in every line.
+    """
+    matches = []
+    for pattern, event_type in patterns:
+        for res in pattern.findall(line):
+            matches.append((event_type, res))
+    return matches
+
+
+def bench(name, func, lines, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        for line in lines:
+            func(line)
+        took = perf_counter() - start
+        best = took if best is None else min(best, took)
+    print('%-17s %10.0f lines/s' % (name, len(lines) / best))
+    return len(lines) / best
+
+
+def main():
+    if len(sys.argv) > 1:
+        lines = list(iter_lines(sys.argv[1]))
+    else:
+        lines = synthetic_log(200000)
+    # Rebuilding the full-line patterns makes sure both sides find the same events
+    full = [(re.compile(PREFIX + '(?:' + pattern.pattern + ')'), event_type)
+            for event_type, (keywords, pattern) in EVENT_PATTERNS.items()]
+    for line in lines[:10000]:
+        assert match_all(full, line) == LINES.match(line), line
+    print('%d lines' % len(lines))
+    before = bench('all patterns', lambda line: match_all(full, line), lines)
+    after = bench('keyword dispatch', LINES.match, lines)
+    print('speedup           %10.1fx' % (after / before))
+    # Custom events, as added by Server.register_event, shouldn't slow down the dispatch
+    patterns = OrderedDict(EVENT_PATTERNS)
+    for i in range(20):
+        patterns['custom_%d' % i] = (('Custom event %d: ' % i,), re.compile('Custom event %d: (.*?)\r?\n' % i))
+    bench('+20 custom events', LineDispatcher(patterns).match, lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the per-call overhead of blocking rcon queries: a new socket and a name lookup per call
+against one long-lived :class:`dplib.rcon.RconSocket`.
+
+Also shows the cost of a response long enough to be followed by another packet, which is complete only
+after :data:`dplib.rcon.QUIET_PERIOD` without packets.
+
+Usage: python benchmarks/rcon_overhead.py [calls]
+A fake server answering every packet runs in a thread on localhost, so the numbers are mostly client overhead.
+"""
+import sys
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Thread
+from time import perf_counter
+
+from dplib.rcon import RconSocket, rcon_packet, FULL_PACKET
+
+RESPONSE = b'\xFF\xFF\xFF\xFFprint\nok\n'
+
+LONG_RESPONSE = b'\xFF\xFF\xFF\xFFprint\n' + b'x' * FULL_PACKET + b'\n'
+
+
+def fake_server(response=RESPONSE):
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+
+    def serve():
+        while True:
+            data, addr = sock.recvfrom(2048)
+            sock.sendto(response, addr)
+    Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def socket_per_call(hostname, port, packet):
+    # What Server.rcon() used to do
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.connect((hostname, port))
+    sock.settimeout(3)
+    sock.send(packet)
+    data = sock.recv(2048)
+    sock.close()
+    return data
+
+
+def bench(name, call, calls):
+    for _ in range(min(100, calls)):
+        call()
+    start = perf_counter()
+    for _ in range(calls):
+        call()
+    elapsed = perf_counter() - start
+    print('%-28s %8.1f us/call' % (name, elapsed / calls * 1e6))
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    port = fake_server()
+    packet = rcon_packet('hello', 'say test')
+    persistent = RconSocket('localhost', port)
+    bench('socket per call', lambda: socket_per_call('localhost', port, packet), calls)
+    bench('persistent RconSocket', lambda: persistent.query(packet), calls)
+    persistent.close()
+    long_port = fake_server(LONG_RESPONSE)
+    persistent = RconSocket('localhost', long_port)
+    bench('persistent, long response', lambda: persistent.query(packet), max(calls // 1000, 10))
+    persistent.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module for computing player statistics from archived logs, using all the CPU cores.
+
+Usage::
+
+    python -m dplib.analyze [-j JOBS] [--chunk-size BYTES] [--json] logfile [logfile ...]
+
+Plain logfiles are split into byte ranges on line boundaries, compressed ones are parsed whole,
+the pieces are parsed in a process pool and the per-player counts are added up.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from dplib.events import ServerEvent
+from dplib.logfile import LineSplitter, LogScanner, is_compressed, open_log
+from dplib.server import parse_line
+
+CHUNK_SIZE = 32 * 1024 * 1024
+# Bytes of a plain logfile parsed by one task
+
+READ_SIZE = 1024 * 1024
+
+PLAYER_COUNTERS = ('kills', 'deaths', 'suicides', 'respawns', 'flag_grabs', 'flag_drops', 'flag_captures',
+                   'messages', 'entrances')
+
+
+class PlayerStats(object):
+    """
+    Counts of a player's events.
+
+    :Attributes:
+
+        * kills, deaths, suicides, respawns, flag_grabs, flag_drops, flag_captures, messages, entrances - counts
+        * weapons - a Counter of kills by weapon
+    """
+    __slots__ = PLAYER_COUNTERS + ('weapons',)
+
+    def __init__(self):
+        for name in PLAYER_COUNTERS:
+            setattr(self, name, 0)
+        self.weapons = Counter()
+
+    def merge(self, other):
+        """
+        Adds the counts of other to this player.
+
+        :type other: :class:`PlayerStats`
+        """
+        for name in PLAYER_COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.weapons.update(other.weapons)
+
+    def to_dict(self):
+        """
+        :rtype: dict
+        """
+        data = {name: getattr(self, name) for name in PLAYER_COUNTERS}
+        data['weapons'] = dict(self.weapons)
+        return data
+
+
+class Stats(object):
+    """
+    Statistics of a piece of a log, pieces are combined with :func:`Stats.merge`.
+
+    :Attributes:
+
+        * lines - number of lines
+        * events - a Counter of events by name
+        * players - dict of nick: :class:`PlayerStats`
+        * maps - a Counter of loaded maps
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.events = Counter()
+        self.players = {}
+        self.maps = Counter()
+
+    def player(self, nick):
+        """
+        Gets the stats of a player, creates them if needed.
+
+        :rtype: :class:`PlayerStats`
+        """
+        stats = self.players.get(nick)
+        if stats is None:
+            stats = self.players[nick] = PlayerStats()
+        return stats
+
+    def add(self, event):
+        """
+        Counts an event.
+
+        :type event: :class:`dplib.events.Event`
+        """
+        event_type = event.type
+        self.events[getattr(event_type, 'name', event_type)] += 1
+        if event_type == ServerEvent.ELIM:
+            killer = self.player(event.killer_nick)
+            if event.suicide:
+                killer.suicides += 1
+                killer.deaths += 1
+            else:
+                killer.kills += 1
+                killer.weapons[event.killer_weapon] += 1
+                self.player(event.victim_nick).deaths += 1
+        elif event_type == ServerEvent.RESPAWN:
+            self.player(event.nick).respawns += 1
+        elif event_type == ServerEvent.FLAG_GRAB:
+            self.player(event.nick).flag_grabs += 1
+        elif event_type == ServerEvent.FLAG_DROP:
+            self.player(event.nick).flag_drops += 1
+        elif event_type == ServerEvent.FLAG_CAPTURED:
+            self.player(event.nick).flag_captures += 1
+        elif event_type == ServerEvent.CHAT:
+            self.player(event.nick).messages += 1
+        elif event_type == ServerEvent.ENTRANCE:
+            self.player(event.nick).entrances += 1
+        elif event_type == ServerEvent.MAPCHANGE:
+            self.maps[event.mapname] += 1
+
+    def merge(self, other):
+        """
+        Adds the statistics of other to these.
+
+        :type other: :class:`Stats`
+        """
+        self.lines += other.lines
+        self.events.update(other.events)
+        self.maps.update(other.maps)
+        for nick, stats in other.players.items():
+            self.player(nick).merge(stats)
+
+    def to_dict(self):
+        """
+        :rtype: dict
+        """
+        return {
+            'lines': self.lines,
+            'events': dict(self.events),
+            'maps': dict(self.maps),
+            'players': {nick: stats.to_dict() for nick, stats in self.players.items()},
+        }
+
+
+def read_lines(path, start=0, end=None):
+    """
+    Yields the lines of a piece of a logfile.
+
+    :param path: Path to the logfile
+    :param start: Offset of the first line
+    :type start: int
+    :param end: Offset the piece ends at (a line start), None for the end of the file
+    :type end: int
+
+    :return: Generator of lines (str, with line endings)
+    :rtype: generator
+    """
+    splitter = LineSplitter()
+    with open_log(path) as f:
+        if start:
+            f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            data = f.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield from splitter.feed(data)
+
+
+def analyze_piece(path, start=0, end=None):
+    """
+    Computes the statistics of a piece of a logfile, runs in the worker processes.
+
+    :param path: Path to the logfile
+    :param start: Offset of the first line
+    :type start: int
+    :param end: Offset the piece ends at, None for the end of the file
+    :type end: int
+
+    :rtype: :class:`Stats`
+    """
+    stats = Stats()
+    lines = 0
+    for line in read_lines(path, start, end):
+        lines += 1
+        for event in parse_line(line):
+            stats.add(event)
+    stats.lines = lines
+    return stats
+
+
+def split_logfiles(paths, chunk_size=CHUNK_SIZE):
+    """
+    Splits logfiles into pieces of about chunk_size bytes, on line boundaries.
+    Compressed logfiles can't be split.
+
+    :param paths: Paths to the logfiles
+    :param chunk_size: Size of a piece in bytes
+    :type chunk_size: int
+
+    :return: List of (path, start, end) tuples
+    :rtype: list
+    """
+    pieces = []
+    for path in paths:
+        if is_compressed(path):
+            pieces.append((path, 0, None))
+            continue
+        with LogScanner(path) as scanner:
+            start = 0
+            while start < scanner.size:
+                end = scanner.line_start(start + chunk_size)
+                pieces.append((path, start, end))
+                start = end
+    return pieces
+
+
+def analyze(paths, jobs=None, chunk_size=CHUNK_SIZE):
+    """
+    Computes the statistics of logfiles in a process pool.
+
+    :param paths: Paths to the logfiles, plain or compressed
+    :param jobs: Number of worker processes, the number of CPUs by default
+    :type jobs: int
+    :param chunk_size: Bytes of a plain logfile parsed by one task
+    :type chunk_size: int
+
+    :rtype: :class:`Stats`
+    """
+    pieces = split_logfiles(paths, chunk_size)
+    stats = Stats()
+    if not pieces:
+        return stats
+    # Whole compressed files and then the biggest pieces go first, so no worker is left with a big one at the end
+    pieces.sort(key=lambda piece: (piece[2] is not None, -os.path.getsize(piece[0]) if piece[2] is None
+                                   else piece[1] - piece[2]))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(analyze_piece, *piece) for piece in pieces]
+        for future in futures:
+            stats.merge(future.result())
+    return stats
+
+
+def print_table(stats, out=sys.stdout):
+    """
+    Prints the players sorted by kills.
+    """
+    print('%d lines, %d events' % (stats.lines, sum(stats.events.values())), file=out)
+    columns = ('kills', 'deaths', 'suicides', 'flag_grabs', 'flag_captures', 'messages')
+    print('%-24s' % 'nick' + ''.join('%14s' % c for c in columns), file=out)
+    for nick, player in sorted(stats.players.items(), key=lambda item: -item[1].kills):
+        print('%-24s' % nick + ''.join('%14d' % getattr(player, c) for c in columns), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m dplib.analyze',
+                                     description='Computes player statistics from DP:PB2 server logs.')
+    parser.add_argument('logfiles', nargs='+', help='plain or compressed (.gz, .bz2, .xz) logfiles')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, defaults to the CPU count')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='bytes of a logfile parsed by one task')
+    parser.add_argument('--json', action='store_true', help='print the statistics as JSON')
+    args = parser.parse_args(argv)
+    stats = analyze(args.logfiles, args.jobs, args.chunk_size)
+    if args.json:
+        json.dump(stats.to_dict(), sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print_table(stats)
+
+
+if __name__ == '__main__':
+    main()
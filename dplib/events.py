@@ -0,0 +1,344 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module with the events found in server logs.
+
+Events are small slotted objects with one class per :class:`ServerEvent`.
+They also behave like dicts of their fields, so an event can be passed to a handler with `**event`
+and the results of the `wait_for_*` methods can still be read like `data['nick']`.
+"""
+import re
+from collections.abc import Mapping
+from enum import Enum
+
+
+class ServerEvent(Enum):
+    TIMEOUT = 0
+    CHAT = 1
+    ELIM = 2
+    RESPAWN = 3
+    MAPCHANGE = 4
+    DATE = 5
+    NAMECHANGE = 6
+    ENTRANCE = 7
+    FLAG_CAPTURED = 8
+    ELIM_TEAMS_FLAG = 9
+    ROUND_STARTED = 10
+    TEAM_SWITCHED = 11
+    DISCONNECT = 12
+    FLAG_GRAB = 13
+    FLAG_DROP = 14
+    ROUND_END = 15
+    GAMEMODE = 16
+    GAME_END = 17
+
+
+TIMESTAMP = re.compile('\\[(\d\d):(\d\d):(\d\d)\\] ')
+
+SCORE = re.compile('(Blue|Red|Yellow|Purple):(-?\d+)')
+# Blue:22 in the GameEnd line
+
+
+def log_time(line):
+    """
+    Gets the time of a log line.
+
+    :param line: Line from logs
+    :type line: str
+
+    :return: Seconds since midnight, None if the line has no timestamp
+    :rtype: int
+    """
+    match = TIMESTAMP.match(line)
+    if not match:
+        return None
+    h, m, s = match.groups()
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+class Event(Mapping):
+    """
+    Base class of the events.
+
+    :Attributes:
+
+        * type - a member of :class:`ServerEvent`, the name of the event for custom events
+        * fields - names of the fields, the same as the arguments of the event handler
+        * check_fields - fields passed to the check functions of the `wait_for_*` methods, None for all the fields
+        * timestamp - seconds since midnight from the log line, None if unknown
+    """
+    __slots__ = ('timestamp',)
+    type = None
+    fields = ()
+    check_fields = None
+
+    def __init__(self, *values, timestamp=None):
+        if len(values) != len(self.fields):
+            raise TypeError('%s takes %d fields but %d were given' %
+                            (type(self).__name__, len(self.fields), len(values)))
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+        self.timestamp = timestamp
+
+    @classmethod
+    def parse(cls, args, timestamp=None):
+        """
+        Creates the event from the groups matched in a log line.
+
+        :param args: Event info (re.findall() results)
+        :param timestamp: Seconds since midnight
+        :type timestamp: int
+
+        :return: The event, None if the line should be ignored
+        :rtype: :class:`Event`
+        """
+        if not cls.fields:
+            args = ()
+        elif isinstance(args, str):
+            # re.findall() gives a string, not a tuple, for patterns with one group
+            args = (args,)
+        return cls(*args, timestamp=timestamp)
+
+    @property
+    def check_args(self):
+        """
+        Values passed to the check functions of listeners.
+
+        :rtype: tuple
+        """
+        return tuple(getattr(self, name) for name in self.check_fields or self.fields)
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.fields + ('timestamp',)))
+
+
+class ChatEvent(Event):
+    """
+    [19:54:18] hTml: test
+    """
+    __slots__ = fields = ('nick', 'message')
+    type = ServerEvent.CHAT
+
+
+class ElimEvent(Event):
+    """
+    [18:54:24] *|ACEBot_1| (Spyder SE) eliminated *|herself| (Spyder SE).
+
+    suicide is 'himself' or 'herself' for paintgren suicides, '' otherwise.
+    """
+    __slots__ = fields = ('killer_nick', 'killer_weapon', 'victim_nick', 'victim_weapon', 'suicide')
+    check_fields = ('killer_nick', 'killer_weapon', 'victim_nick', 'victim_weapon')
+    type = ServerEvent.ELIM
+
+
+class RespawnEvent(Event):
+    """
+    [19:03:57] *Red's ACEBot_6 revived!
+    """
+    __slots__ = fields = ('team', 'nick')
+    type = ServerEvent.RESPAWN
+
+
+class EntranceEvent(Event):
+    """
+    [19:03:57] mRokita entered the game (build 41) [127.0.0.1:23414]
+    """
+    __slots__ = fields = ('nick', 'build', 'addr')
+    type = ServerEvent.ENTRANCE
+
+
+class FlagCapturedEvent(Event):
+    """
+    [18:54:24] *Red's hTml returned the *Blue flag!
+    """
+    __slots__ = fields = ('team', 'nick', 'flag')
+    type = ServerEvent.FLAG_CAPTURED
+
+
+class ElimTeamsFlagEvent(Event):
+    """
+    [19:30:23] *Blue's mRokita earned 3 points for possesion of eliminated teams flag!
+    """
+    __slots__ = fields = ('team', 'nick', 'points')
+    type = ServerEvent.ELIM_TEAMS_FLAG
+
+    @classmethod
+    def parse(cls, args, timestamp=None):
+        return cls(args[0], args[1], int(args[2]), timestamp=timestamp)
+
+
+class RoundStartedEvent(Event):
+    """
+    [10:20:11] Round started...
+    """
+    __slots__ = fields = ()
+    type = ServerEvent.ROUND_STARTED
+
+
+class TeamSwitchedEvent(Event):
+    """
+    [10:20:11] mRokita switched from *Blue to *Red.
+    [10:20:11] mRokita joined the *Red team.
+    [10:20:11] mRokita is now observing.
+
+    old_team is 'Observer' when joining a team and None when going to observe.
+    """
+    __slots__ = fields = ('nick', 'old_team', 'new_team')
+    type = ServerEvent.TEAM_SWITCHED
+
+    @classmethod
+    def parse(cls, args, timestamp=None):
+        args = [arg for arg in args if arg]
+        nick = args[0]
+        old_team = args[1] if len(args) > 2 else 'Observer'
+        new_team = args[2] if len(args) > 2 else args[1] if len(args) > 1 else 'observing'
+        if new_team == 'observing':
+            new_team = 'Observer'
+            old_team = None
+        return cls(nick, old_team, new_team, timestamp=timestamp)
+
+
+class GameEndEvent(Event):
+    """
+    [22:40:33]         GameEnd    1032.6    Red:23,Blue:22
+
+    Scores are ints, None for the teams that didn't play.
+    """
+    __slots__ = fields = ('score_blue', 'score_red', 'score_yellow', 'score_purple')
+    type = ServerEvent.GAME_END
+
+    @classmethod
+    def parse(cls, args, timestamp=None):
+        scores = dict(SCORE.findall(args))
+        return cls(*(int(scores[team]) if team in scores else None for team in ('Blue', 'Red', 'Yellow', 'Purple')),
+                   timestamp=timestamp)
+
+
+class MapChangeEvent(Event):
+    """
+    [10:20:11] == Map Loaded: airtime ==
+    """
+    __slots__ = fields = ('mapname',)
+    type = ServerEvent.MAPCHANGE
+
+
+class NameChangeEvent(Event):
+    """
+    [19:54:54] name1 changed name to name2.
+    """
+    __slots__ = fields = ('old_nick', 'new_nick')
+    type = ServerEvent.NAMECHANGE
+
+
+class DisconnectEvent(Event):
+    """
+    [19:03:57] whoa disconnected.
+    """
+    __slots__ = fields = ('nick',)
+    type = ServerEvent.DISCONNECT
+
+
+class FlagGrabEvent(Event):
+    """
+    [19:03:57] *whoa got the *Red flag!
+    """
+    __slots__ = fields = ('nick', 'flag')
+    type = ServerEvent.FLAG_GRAB
+
+
+class FlagDropEvent(Event):
+    """
+    [19:03:57] *whoa dropped the flag!
+    """
+    __slots__ = fields = ('nick',)
+    type = ServerEvent.FLAG_DROP
+
+
+class RoundEndEvent(Event):
+    """
+    [14:38:50] Blue team wins the round!
+    """
+    __slots__ = fields = ()
+    type = ServerEvent.ROUND_END
+
+
+class GameModeEvent(Event):
+    """
+    [09:58:11] === Team Flag CTF ===
+    """
+    __slots__ = fields = ('gamemode',)
+    type = ServerEvent.GAMEMODE
+
+
+EVENT_CLASSES = {
+    cls.type: cls for cls in (
+        ChatEvent, ElimEvent, RespawnEvent, EntranceEvent, FlagCapturedEvent, ElimTeamsFlagEvent, RoundStartedEvent,
+        TeamSwitchedEvent, GameEndEvent, MapChangeEvent, NameChangeEvent, DisconnectEvent, FlagGrabEvent,
+        FlagDropEvent, RoundEndEvent, GameModeEvent,
+    )
+}
+
+RESERVED_FIELDS = frozenset(name for name in dir(Event) if not name.startswith('_'))
+# Names of the Event attributes and Mapping methods (keys, get...), a field would shadow them
+
+
+def make_event_class(event_type, fields, parser=None):
+    """
+    Creates an event class for a custom event.
+
+    :param event_type: Name of the event
+    :type event_type: str
+    :param fields: Names of the fields
+    :type fields: tuple
+    :param parser: Function converting the groups matched in the log line (re.findall() results)
+        to a tuple of the field values, it can return None to ignore the line.
+        Without a parser the groups are used as they are.
+
+    :rtype: type
+    """
+    fields = tuple(fields)
+    for name in fields:
+        if not name.isidentifier() or name.startswith('_') or name in RESERVED_FIELDS:
+            raise ValueError('Invalid field name: %r' % name)
+    attrs = {
+        '__slots__': fields,
+        '__doc__': 'Custom event \'%s\'' % event_type,
+        '__module__': __name__,
+        'type': event_type,
+        'fields': fields,
+    }
+    if parser:
+        def parse(cls, args, timestamp=None):
+            values = parser(args)
+            if values is None:
+                return None
+            return cls(*values, timestamp=timestamp)
+        attrs['parse'] = classmethod(parse)
+    name = ''.join(part.capitalize() for part in re.split('[^0-9a-zA-Z]+', event_type)) + 'Event'
+    return type(name, (Event,), attrs)
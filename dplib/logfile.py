@@ -0,0 +1,718 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module for following DP logfiles
+"""
+import asyncio
+import bz2
+import gzip
+import io
+import json
+import lzma
+import mmap
+import os
+import re
+from collections import deque
+from hashlib import sha1
+from time import time
+
+from dplib.logwatch import watch_file
+
+CHECKPOINT_INTERVAL = 5
+# Seconds between two checkpoints
+
+LAST_LINE_MAX = 64 * 1024
+# Bytes of the logfile kept to hash the last line
+
+COMPRESSED_READ_SIZE = 1024 * 1024
+# Size of the buffer compressed data is read with
+
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+PTY_READ_SIZE = 64 * 1024
+# Bytes read from the pty master in one os.read() call
+
+MAX_LINE_LENGTH = 16 * 1024
+# Longer lines are dropped
+
+LINE = re.compile('[^\\n]*\\n')
+
+TIMESTAMP = re.compile(b'\\[(\\d\\d:\\d\\d:\\d\\d)\\] ')
+
+
+def is_compressed(path):
+    """
+    Check if the logfile is compressed, based on its extension (.gz, .bz2 or .xz).
+
+    :param path: Path to the logfile
+
+    :rtype: bool
+    """
+    return os.path.splitext(path)[1] in COMPRESSED_OPENERS
+
+
+def open_log(path):
+    """
+    Opens a logfile for reading, compressed logs are decompressed on the fly.
+
+    :param path: Path to the logfile
+
+    :return: Binary file object
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1])
+    if opener is None:
+        return open(path, 'rb')
+    raw = open(path, 'rb', buffering=COMPRESSED_READ_SIZE)
+    try:
+        return CompressedLog(opener(raw), raw)
+    except Exception:
+        raw.close()
+        raise
+
+
+class CompressedLog(io.BufferedReader):
+    """
+    Decompressed view of a compressed logfile, closes the underlying file too.
+
+    :param decompressor: GzipFile, BZ2File or LZMAFile reading from raw
+    :param raw: Compressed file, opened with a large buffer
+    """
+
+    def __init__(self, decompressor, raw):
+        super(CompressedLog, self).__init__(decompressor, buffer_size=COMPRESSED_READ_SIZE)
+        self.__raw = raw
+
+    def close(self):
+        try:
+            super(CompressedLog, self).close()
+        finally:
+            self.__raw.close()
+
+
+def iter_lines(path):
+    """
+    Yields complete lines of a plain or compressed logfile.
+    Plain logfiles are walked with :class:`LogScanner`, compressed ones are streamed.
+
+    :param path: Path to the logfile
+
+    :return: Generator of lines (bytes, with line endings)
+    :rtype: generator
+    """
+    if not is_compressed(path):
+        with LogScanner(path) as scanner:
+            yield from scanner.lines()
+        return
+    with open_log(path) as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                yield line
+
+
+def scan_compressed(path, tail=None, since=None):
+    """
+    Finds the lines :func:`LogScanner.offset_of_tail` or :func:`LogScanner.offset_since` would start at,
+    for compressed logfiles, which can't be mapped. The logfile is decompressed once from the start
+    and only the lines selected so far are kept in memory.
+
+    :param path: Path to the logfile
+    :param tail: Number of bytes from the end
+    :type tail: int
+    :param since: Time in the HH:MM:SS format, used instead of tail
+    :type since: str
+
+    :return: Offset of the first line (in decompressed bytes) and the complete lines from there to the end
+    :rtype: tuple
+    """
+    since = since.encode('latin-1') if since else None
+    lines = deque()
+    size = 0
+    end = 0
+    newest = None
+    stamped = 0
+    # Number of selected lines up to the last one with a timestamp
+    with open_log(path) as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                end += len(line)
+            if since is not None:
+                match = TIMESTAMP.match(line)
+                if match:
+                    line_time = match.group(1)
+                    if line_time < since:
+                        lines.clear()
+                        size = stamped = 0
+                        newest = None
+                        continue
+                    if newest is not None and line_time < newest:
+                        # Midnight, the run starts after the last line logged before it
+                        for i in range(stamped):
+                            size -= len(lines.popleft())
+                    newest = line_time
+                    stamped = len(lines) + 1
+            if not line.endswith(b'\n'):
+                # Incomplete line, it's still being written. It counts to the tail like it does in LogScanner.
+                while since is None and lines and size + len(line) > tail:
+                    size -= len(lines.popleft())
+                break
+            lines.append(line)
+            size += len(line)
+            while since is None and size > tail:
+                size -= len(lines.popleft())
+    return end - size, list(lines)
+
+
+class LogFile(object):
+    """
+    Follows a logfile like tail -F does - the file is reopened when it gets rotated
+    and read from the start again when it gets truncated.
+
+    The read offset can be checkpointed to a small state file, so after a restart
+    only the data that wasn't handled yet is read.
+
+    Compressed (.gz, .bz2, .xz) logs are decompressed on the fly, offsets are then
+    counted in decompressed bytes.
+
+    :param path: Path to the logfile
+    :param loop: Event loop
+    :param checkpoint_file: Path to the checkpoint file, None disables checkpoints
+    :param checkpoint_interval: Minimum number of seconds between two checkpoints
+    :type checkpoint_interval: float
+    :param use_inotify: Wake up only when the logfile is modified (Linux only)
+    :type use_inotify: bool
+    :param poll_interval: Seconds to sleep at EOF when inotify is not used
+    :type poll_interval: float
+    """
+
+    #: A followed logfile never ends, more data can always be appended
+    eof = False
+
+    def __init__(self, path, loop=None, checkpoint_file=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 use_inotify=True, poll_interval=0.05):
+        self.path = path
+        self.loop = loop
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.use_inotify = use_inotify
+        self.poll_interval = poll_interval
+        self.compressed = is_compressed(path)
+        self.__file = None
+        self.__inode = None
+        self.__watcher = None
+        self.__tail = b''
+        self.__last_checkpoint = 0
+        self.resumed = False
+
+    @property
+    def position(self):
+        """
+        Offset of the next byte to read.
+
+        :rtype: int
+        """
+        return self.__file.tell()
+
+    def open(self, skip_old=False, offset=None):
+        """
+        Opens the logfile. Resumes from the checkpoint if it's valid for the file,
+        otherwise starts at offset, at the beginning or at the end if skip_old is set.
+
+        :param skip_old: Skip data present in the logfile
+        :type skip_old: bool
+        :param offset: Offset to start reading at
+        :type offset: int
+        """
+        self.__open()
+        if self.loop:
+            self.__watcher = watch_file(self.path, self.loop, self.poll_interval, self.use_inotify)
+        checkpoint = self.__load_checkpoint()
+        self.resumed = checkpoint is not None
+        if checkpoint is not None:
+            self.seek(checkpoint)
+        elif offset is not None:
+            self.seek(offset)
+        elif skip_old:
+            self.seek(self.__size())
+        else:
+            self.seek(0)
+        self.__last_checkpoint = time()
+
+    def __open(self):
+        self.__file = open_log(self.path)
+        self.__inode = os.fstat(self.__file.fileno()).st_ino
+        self.__tail = b''
+
+    def __size(self):
+        """
+        :return: Size of the (decompressed) data
+        :rtype: int
+        """
+        if not self.compressed:
+            return os.fstat(self.__file.fileno()).st_size
+        # The size of compressed data is known only after decompressing it
+        while self.__file.read(COMPRESSED_READ_SIZE):
+            pass
+        return self.__file.tell()
+
+    def seek(self, offset):
+        """
+        Moves the read offset.
+
+        :param offset: Offset in bytes
+        :type offset: int
+        """
+        # Read back the end of the previous line, it's needed for checkpoints
+        start = max(0, offset - LAST_LINE_MAX)
+        self.__file.seek(start)
+        self.__tail = self.__file.read(offset - start)
+
+    def read(self, size):
+        """
+        Reads up to size bytes. At EOF checks if the file was rotated or truncated
+        and continues with the new data.
+
+        :param size: Maximum number of bytes to read
+        :type size: int
+
+        :return: Data, empty at EOF
+        :rtype: bytes
+        """
+        data = self.__file.read(size)
+        if len(data) < size and self.__reopen_if_changed():
+            data += self.__file.read(size - len(data))
+        if data:
+            self.__tail = (self.__tail + data)[-LAST_LINE_MAX:]
+        return data
+
+    def __reopen_if_changed(self):
+        """
+        Reopens the logfile if it was rotated, rewinds it if it was truncated.
+
+        :return: True if the file was reopened or rewound
+        :rtype: bool
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # Rotated, the new file is not there yet
+            return False
+        if st.st_ino != self.__inode:
+            self.__file.close()
+            self.__open()
+            if self.__watcher:
+                self.__watcher.rewatch()
+            return True
+        if not self.compressed and st.st_size < self.__file.tell():
+            self.__file.seek(0)
+            self.__tail = b''
+            return True
+        return False
+
+    def wait(self):
+        """
+        Waits for new data.
+        """
+        return self.__watcher.wait()
+
+    def wake(self):
+        """
+        Wakes up the coroutine waiting for new data.
+        """
+        if self.__watcher:
+            self.__watcher.wake()
+
+    @staticmethod
+    def __last_line_hash(tail):
+        """
+        Hashes the last line of some data.
+
+        :param tail: Data ending with a complete line
+        :type tail: bytes
+
+        :return: sha1 hexdigest, None if there is no data
+        :rtype: str
+        """
+        if not tail:
+            return None
+        return sha1(tail[tail.rfind(b'\n', 0, len(tail) - 1) + 1:]).hexdigest()
+
+    def checkpoint(self, pending=0, force=False):
+        """
+        Saves the read offset to the checkpoint file, at most once per checkpoint_interval.
+
+        :param pending: Number of bytes already read, but not handled yet
+        :type pending: int
+        :param force: Ignore checkpoint_interval
+        :type force: bool
+        """
+        if not self.checkpoint_file or not self.__file:
+            return
+        if not force and time() - self.__last_checkpoint < self.checkpoint_interval:
+            return
+        self.__last_checkpoint = time()
+        state = {
+            'path': os.path.abspath(self.path),
+            'inode': self.__inode,
+            'offset': self.__file.tell() - pending,
+            'hash': self.__last_line_hash(self.__tail[:len(self.__tail) - pending]),
+        }
+        tmp_name = self.checkpoint_file + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_name, self.checkpoint_file)
+
+    def __load_checkpoint(self):
+        """
+        Validates the checkpoint against the opened file.
+        A checkpoint saved for another path or inode is ignored without looking at the data.
+
+        :return: Offset to resume from, None if there is no valid checkpoint
+        :rtype: int
+        """
+        if not self.checkpoint_file:
+            return None
+        try:
+            with open(self.checkpoint_file) as f:
+                state = json.load(f)
+            path = state['path']
+            inode = state['inode']
+            offset = state['offset']
+            last_hash = state['hash']
+        except (OSError, ValueError, KeyError):
+            return None
+        if inode != self.__inode or path != os.path.abspath(self.path):
+            # Rotated, replaced, or a checkpoint of a different logfile
+            return None
+        self.seek(offset)
+        if self.__file.tell() != offset:
+            # Truncated
+            return None
+        if self.__last_line_hash(self.__tail) != last_hash:
+            # Data before the offset isn't the same, it was rewritten in place
+            return None
+        return offset
+
+    def close(self):
+        """
+        Closes the logfile.
+        """
+        if self.__watcher:
+            self.__watcher.close()
+            self.__watcher = None
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+
+class LineSplitter(object):
+    """
+    Splits a stream of log data into lines.
+
+    Works on bytes with a reusable buffer, only the incomplete tail of each chunk is kept
+    and only complete lines are decoded.
+
+    :param max_line_length: Lines longer than this are dropped, so a spammed line can't grow the buffer forever
+    :type max_line_length: int
+    """
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self.__buffer = bytearray()
+        self.__discarding = False
+
+    @property
+    def pending(self):
+        """
+        Number of buffered bytes of the incomplete line.
+
+        :rtype: int
+        """
+        return len(self.__buffer)
+
+    def feed(self, data):
+        """
+        Adds data to the buffer.
+
+        :param data: Data read from the log
+        :type data: bytes
+
+        :return: Complete lines (with line endings)
+        :rtype: list
+        """
+        end = data.rfind(b'\n') + 1
+        if not end:
+            if not self.__discarding:
+                self.__buffer += data
+                if len(self.__buffer) > self.max_line_length:
+                    self.__buffer.clear()
+                    self.__discarding = True
+            return []
+        if self.__discarding:
+            # Skip the rest of the overlong line
+            self.__discarding = False
+            start = data.find(b'\n') + 1
+            self.__buffer += data[start:end]
+        else:
+            self.__buffer += data[:end]
+        text = self.__buffer.decode('latin-1')
+        self.__buffer.clear()
+        self.__buffer += data[end:]
+        lines = LINE.findall(text)
+        if len(text) > self.max_line_length:
+            lines = [line for line in lines if len(line) <= self.max_line_length]
+        return lines
+
+
+class LogScanner(object):
+    """
+    Walks the lines of a logfile in place using mmap, without loading it into memory.
+
+    :param path: Path to the logfile
+
+    :example:
+    .. code-block:: python
+        :linenos:
+
+        >>> from dplib.logfile import LogScanner
+        >>> with LogScanner('qconsole27910.log') as scanner:
+        ...     for line in scanner.lines(scanner.offset_since('19:00:00')):
+        ...         print(line)
+        b'[19:00:02] mRokita entered the game (build 41) [127.0.0.1:9419]\\n'
+    """
+
+    def __init__(self, path):
+        if is_compressed(path):
+            raise ValueError("Compressed logs can't be mapped, use iter_lines() or scan_compressed()")
+        self.path = path
+        self.__file = open(path, 'rb')
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            self.__map = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def size(self):
+        """
+        Size of the mapped data.
+
+        :rtype: int
+        """
+        return len(self.__map)
+
+    def line_start(self, offset):
+        """
+        Finds the first line starting at or after offset.
+
+        :param offset: Offset in bytes
+        :type offset: int
+
+        :return: Offset of the line
+        :rtype: int
+        """
+        if offset <= 0:
+            return 0
+        nl = self.__map.find(b'\n', offset - 1)
+        return nl + 1 if nl >= 0 else self.size
+
+    def offset_of_tail(self, size):
+        """
+        Finds the first line of the last size bytes.
+
+        :param size: Number of bytes from the end
+        :type size: int
+
+        :return: Offset of the line
+        :rtype: int
+        """
+        return self.line_start(self.size - size)
+
+    def offset_since(self, timestamp):
+        """
+        Finds the first line of the most recent run of lines logged at or after the timestamp.
+        The logfile is walked backwards from the end, so only the tail is touched.
+        Stops at midnight, as timestamps don't have dates.
+
+        :param timestamp: Time in the HH:MM:SS format
+        :type timestamp: str
+
+        :return: Offset of the line
+        :rtype: int
+        """
+        timestamp = timestamp.encode('latin-1')
+        start = end = self.size
+        newest = None
+        while end > 0:
+            line_start = self.__map.rfind(b'\n', 0, end - 1) + 1
+            match = TIMESTAMP.match(self.__map, line_start)
+            if match:
+                line_time = match.group(1)
+                if line_time < timestamp or (newest is not None and line_time > newest):
+                    break
+                newest = line_time
+            start = end = line_start
+        return start
+
+    def lines(self, start=0, end=None):
+        """
+        Yields complete lines between start and end.
+
+        :param start: Offset of the first line
+        :type start: int
+        :param end: Offset to stop at, defaults to the end of the mapped data
+        :type end: int
+
+        :return: Generator of lines (with line endings)
+        :rtype: generator
+        """
+        mm = self.__map
+        if end is None:
+            end = self.size
+        pos = start
+        while pos < end:
+            nl = mm.find(b'\n', pos, end)
+            if nl < 0:
+                # Incomplete line, it's still being written
+                return
+            yield mm[pos:nl + 1]
+            pos = nl + 1
+
+    def close(self):
+        """
+        Unmaps and closes the logfile.
+        """
+        if isinstance(self.__map, mmap.mmap):
+            self.__map.close()
+        self.__file.close()
+
+
+class PtyLog(object):
+    """
+    Reads the console output of a dp2 process from the master side of its pty.
+
+    The pty is drained in the event loop as soon as it becomes readable (loop.add_reader),
+    so the loop never blocks on it and the dp2 process never stalls on a full pty buffer.
+
+    :param fd: pty master file descriptor
+    :type fd: int
+    :param loop: Event loop
+    :param read_size: Maximum number of bytes read from the pty in one os.read() call
+    :type read_size: int
+    """
+
+    def __init__(self, fd, loop, read_size=PTY_READ_SIZE):
+        self.fd = fd
+        self.loop = loop
+        self.read_size = read_size
+        self.__buffer = bytearray()
+        self.__waiter = None
+        self.__eof = False
+
+    def open(self):
+        """
+        Registers the pty in the event loop.
+        """
+        os.set_blocking(self.fd, False)
+        self.loop.add_reader(self.fd, self.__on_readable)
+
+    def __on_readable(self):
+        """
+        Moves everything available in the pty to the buffer.
+        """
+        try:
+            while True:
+                data = os.read(self.fd, self.read_size)
+                if not data:
+                    self.__set_eof()
+                    break
+                self.__buffer += data
+                if len(data) < self.read_size:
+                    break
+        except BlockingIOError:
+            pass
+        except OSError:
+            # EIO - the slave side was closed, the process is gone
+            self.__set_eof()
+        self.wake()
+
+    def __set_eof(self):
+        self.__eof = True
+        self.loop.remove_reader(self.fd)
+
+    @property
+    def eof(self):
+        """
+        True when the process is gone and everything it printed was read.
+
+        :rtype: bool
+        """
+        return self.__eof and not self.__buffer
+
+    def read(self, size):
+        """
+        Reads up to size bytes of buffered output.
+
+        :param size: Maximum number of bytes to read
+        :type size: int
+
+        :return: Data, empty if nothing is buffered
+        :rtype: bytes
+        """
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    @asyncio.coroutine
+    def wait(self):
+        """
+        Waits until the pty has new output, returns right away once the process is gone.
+        """
+        if self.__buffer or self.__eof:
+            return
+        self.__waiter = asyncio.Future(loop=self.loop)
+        try:
+            yield from self.__waiter
+        finally:
+            self.__waiter = None
+
+    def wake(self):
+        """
+        Wakes up the coroutine waiting for new output.
+        """
+        if self.__waiter and not self.__waiter.done():
+            self.__waiter.set_result(None)
+
+    def checkpoint(self, pending=0, force=False):
+        pass
+
+    def close(self):
+        """
+        Unregisters and closes the pty master.
+        """
+        if not self.__eof:
+            self.loop.remove_reader(self.fd)
+        os.close(self.fd)
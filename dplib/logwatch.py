@@ -0,0 +1,316 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module for waiting on logfile changes.
+Uses inotify on Linux and falls back to polling everywhere else.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+DIR_WATCH_MASK = IN_CREATE | IN_MOVED_TO
+
+EVENT = struct.Struct('iIII')
+# struct inotify_event without the name
+
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    """
+    Loads libc if it provides the inotify API.
+
+    :return: libc handle or None
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    """
+    Check if inotify can be used on this system.
+
+    :rtype: bool
+    """
+    return _libc is not None
+
+
+class PollingWatcher(object):
+    """
+    Wakes up every `interval` seconds, whether the file has changed or not.
+
+    :param path: Path to the watched file
+    :param loop: Event loop
+    :param interval: Poll interval in seconds
+    :type interval: float
+    """
+
+    def __init__(self, path, loop=None, interval=0.05):
+        self.path = path
+        self.loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+
+    @asyncio.coroutine
+    def wait(self):
+        """
+        Waits for the next poll.
+        """
+        yield from asyncio.sleep(self.interval)
+
+    def wake(self):
+        pass
+
+    def rewatch(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Inotify(object):
+    """
+    A single inotify instance shared by all watchers of an event loop,
+    so following many logfiles costs one file descriptor and one reader callback.
+    Use :func:`Inotify.for_loop` to get it.
+
+    :param loop: Event loop
+    """
+    __instances = {}
+
+    def __init__(self, loop):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.loop = loop
+        self.__callbacks = {}
+        self.__fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.loop.add_reader(self.__fd, self.__on_readable)
+
+    @classmethod
+    def for_loop(cls, loop):
+        """
+        Gets the inotify instance of an event loop, creates it if needed.
+
+        :param loop: Event loop
+
+        :rtype: :class:`Inotify`
+        """
+        if loop not in cls.__instances:
+            cls.__instances[loop] = cls(loop)
+        return cls.__instances[loop]
+
+    def add_watch(self, path, mask, callback):
+        """
+        Watches a path.
+
+        :param path: Path to a file or a directory
+        :param mask: inotify event mask
+        :param callback: Called with the event mask and name for every event
+
+        :return: Watch descriptor
+        :rtype: int
+        """
+        if self.__fd is None:
+            raise OSError(errno.EBADF, 'inotify instance is closed')
+        wd = _libc.inotify_add_watch(self.__fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.__callbacks.setdefault(wd, []).append(callback)
+        return wd
+
+    def rm_watch(self, wd, callback):
+        """
+        Stops calling the callback for a watch, removes the watch when nobody uses it.
+        Closes the instance when there are no watches left.
+
+        :param wd: Watch descriptor
+        :param callback: Callback passed to :func:`Inotify.add_watch`
+        """
+        callbacks = self.__callbacks.get(wd, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks and wd in self.__callbacks:
+            del self.__callbacks[wd]
+            _libc.inotify_rm_watch(self.__fd, wd)
+        if not self.__callbacks:
+            self.close()
+
+    def __on_readable(self):
+        """
+        Reads the queued events and dispatches them to the callbacks of their watches.
+        """
+        try:
+            data = os.read(self.__fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, name_len = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = os.fsdecode(data[pos:pos + name_len].rstrip(b'\0'))
+            pos += name_len
+            if mask & IN_IGNORED:
+                # The watched file is gone, the kernel dropped the watch
+                callbacks = self.__callbacks.pop(wd, [])
+            else:
+                callbacks = self.__callbacks.get(wd, [])
+            for callback in list(callbacks):
+                callback(mask, name)
+
+    def close(self):
+        """
+        Closes the inotify instance.
+        """
+        if self.__fd is not None:
+            self.loop.remove_reader(self.__fd)
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__instances.get(self.loop) is self:
+            del self.__instances[self.loop]
+
+
+class InotifyWatcher(object):
+    """
+    Wakes up only when the watched file is modified, using inotify registered in the event loop.
+    The parent directory is watched too, so a file created in place of a rotated one is noticed.
+
+    :param path: Path to the watched file
+    :param loop: Event loop
+    :param timeout: Wake up after this many seconds even if nothing has changed, None to wait forever
+    :type timeout: float
+    """
+
+    def __init__(self, path, loop=None, timeout=None):
+        self.path = path
+        self.loop = loop or asyncio.get_event_loop()
+        self.timeout = timeout
+        self.__changed = False
+        self.__waiter = None
+        self.__name = os.path.basename(path)
+        self.__inotify = Inotify.for_loop(self.loop)
+        self.__dir_wd = self.__wd = -1
+        try:
+            self.__dir_wd = self.__inotify.add_watch(os.path.dirname(os.path.abspath(path)), DIR_WATCH_MASK,
+                                                     self.__on_dir_event)
+            self.__wd = self.__inotify.add_watch(path, WATCH_MASK, self.__on_file_event)
+        except OSError:
+            self.close()
+            raise
+
+    def __on_file_event(self, mask, name):
+        self.wake()
+
+    def __on_dir_event(self, mask, name):
+        if name == self.__name:
+            self.wake()
+
+    def wake(self):
+        """
+        Wakes up the waiting coroutine, as if the file was modified.
+        """
+        self.__changed = True
+        if self.__waiter and not self.__waiter.done():
+            self.__waiter.set_result(None)
+
+    def rewatch(self):
+        """
+        Moves the file watch to the file currently at `path`, call after the file was rotated.
+        """
+        if self.__wd >= 0:
+            self.__inotify.rm_watch(self.__wd, self.__on_file_event)
+        try:
+            self.__wd = self.__inotify.add_watch(self.path, WATCH_MASK, self.__on_file_event)
+        except OSError:
+            self.__wd = -1
+
+    @asyncio.coroutine
+    def wait(self):
+        """
+        Waits until the file is modified (or the timeout passes).
+        """
+        if not self.__changed:
+            self.__waiter = asyncio.Future(loop=self.loop)
+            try:
+                yield from asyncio.wait_for(self.__waiter, self.timeout, loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.__waiter = None
+        self.__changed = False
+
+    def close(self):
+        """
+        Stops watching the file.
+        """
+        if self.__wd >= 0:
+            self.__inotify.rm_watch(self.__wd, self.__on_file_event)
+            self.__wd = -1
+        if self.__dir_wd >= 0:
+            self.__inotify.rm_watch(self.__dir_wd, self.__on_dir_event)
+            self.__dir_wd = -1
+
+
+def watch_file(path, loop=None, interval=0.05, use_inotify=True):
+    """
+    Creates the best watcher available for the file.
+
+    :param path: Path to the watched file
+    :param loop: Event loop
+    :param interval: Poll interval used when inotify is not available
+    :type interval: float
+    :param use_inotify: Try to use inotify
+    :type use_inotify: bool
+
+    :return: An instance of :class:`InotifyWatcher` or :class:`PollingWatcher`
+    """
+    if use_inotify and inotify_available():
+        try:
+            return InotifyWatcher(path, loop)
+        except OSError:
+            pass
+    return PollingWatcher(path, loop, interval)
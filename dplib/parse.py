@@ -17,6 +17,8 @@
 """
 A module for parsing DP data
 """
+import re
+from collections import OrderedDict
 
 
 CHAR_TAB = ['\0', '-', '-', '-', '_', '*', 't', '.', 'N', '-', '\n', '#', '.', '>', '*', '*',
@@ -37,27 +39,168 @@ CHAR_TAB = ['\0', '-', '-', '-', '_', '*', 't', '.', 'N', '-', '\n', '#', '.', '
             'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z', '{', '|', '}', '~', '<']
 
 
+DECODE_TABLE = ''.join(CHAR_TAB).encode('latin-1')
+# bytes.translate() table made of CHAR_TAB
+
+MARKUP = b'\x86\x87'
+# 134-underline and 135-italic, deleted by bytes.translate()
+
+COLOR = re.compile(b'\x88+.?', re.DOTALL)
+# 136-color and the char after it (136 after 136 takes one more char)
+
+LINE_COLOR = re.compile(b'\x88+[^\x88\n]?')
+# COLOR for texts without line breaks, a line break is never eaten, so it can separate the texts
+
+
+def _decode(data, color):
+    if b'\x88' in data:
+        data = color.sub(b'', data)
+    return data.translate(DECODE_TABLE, MARKUP).decode('latin-1')
+
+
+class LRUCache(object):
+    """
+    A bounded cache dropping the least recently used entries, with hit/miss counters.
+
+    :param maxsize: Max number of entries
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data = OrderedDict()
+
+    def get(self, key):
+        """
+        Gets a cached value and marks it as recently used.
+
+        :return: The value, None if it's not cached
+        """
+        value = self.__data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Caches a value, drops the least recently used one if the cache is full.
+        """
+        self.__data[key] = value
+        self.__data.move_to_end(key)
+        if len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all the entries and resets the counters.
+        """
+        self.__data.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        """
+        :return: Dict with hits, misses, size and maxsize
+        :rtype: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.__data), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self.__data)
+
+
+_decode_cache = None
+_render_cache = None
+
+
+def enable_cache(maxsize=1024):
+    """
+    Turns on caching of :func:`decode_ingame_text`, :func:`decode_ingame_texts` and :func:`render_text`,
+    so the nicks and messages seen over and over are computed once. Resets the caches if they're on already.
+
+    :param maxsize: Max number of entries of each cache
+    :type maxsize: int
+    """
+    global _decode_cache, _render_cache
+    _decode_cache = LRUCache(maxsize)
+    _render_cache = LRUCache(maxsize)
+
+
+def disable_cache():
+    """
+    Turns off caching and drops the caches.
+    """
+    global _decode_cache, _render_cache
+    _decode_cache = _render_cache = None
+
+
+def cache_info():
+    """
+    Gets the cache counters.
+
+    :return: Dict with 'decode' and 'render' keys, values are :func:`LRUCache.info` dicts, None if caching is off
+    :rtype: dict
+    """
+    return {
+        'decode': _decode_cache.info() if _decode_cache is not None else None,
+        'render': _render_cache.info() if _render_cache is not None else None,
+    }
+
+
 def decode_ingame_text(text):
     """
-    Removes special chars from ingame messages/nicks
+    Removes special chars from ingame messages/nicks.
+    Chars above 255 (the game never sends them) become '?'.
 
     :param text: Text to decode
     :return: Decoded text
     """
-    cleaned_text = ""
-    skip_next = False
-    for i in text:
-        char_ascii = ord(i)
-        # 134-underline, 135-italic, 136-color
-        if char_ascii == 134 or char_ascii == 135 or char_ascii == 136 or skip_next:  # Remove underline, italic symbols
-            if char_ascii == 136:
-                skip_next = True
-            else:
-                skip_next = False
-        else:
-            cleaned_text = cleaned_text + CHAR_TAB[char_ascii]
-            skip_next = False
-    return cleaned_text
+    cache = _decode_cache
+    if cache is None:
+        return _decode(text.encode('latin-1', 'replace'), COLOR)
+    decoded = cache.get(text)
+    if decoded is None:
+        decoded = _decode(text.encode('latin-1', 'replace'), COLOR)
+        cache.put(text, decoded)
+    return decoded
+
+
+def _decode_texts(texts):
+    if not texts:
+        return []
+    joined = '\n'.join(texts)
+    if joined.count('\n') != len(texts) - 1:
+        # Some text has a line break, it can't be used as a separator
+        return [_decode(text.encode('latin-1', 'replace'), COLOR) for text in texts]
+    return _decode(joined.encode('latin-1', 'replace'), LINE_COLOR).split('\n')
+
+
+def decode_ingame_texts(texts):
+    """
+    Decodes many messages/nicks at once, see :func:`decode_ingame_text`.
+
+    :param texts: Texts to decode
+    :type texts: iterable
+
+    :return: Decoded texts
+    :rtype: list
+    """
+    texts = list(texts)
+    cache = _decode_cache
+    if cache is None:
+        return _decode_texts(texts)
+    decoded = [cache.get(text) for text in texts]
+    missing = [i for i, text in enumerate(decoded) if text is None]
+    if missing:
+        # Only the texts that aren't cached are decoded, still in one pass
+        for i, text in zip(missing, _decode_texts([texts[i] for i in missing])):
+            decoded[i] = text
+            cache.put(texts[i], text)
+    return decoded
 
 
 def render_text(text):
@@ -71,7 +214,14 @@ def render_text(text):
     :return: DP message
     :rtype: str
     """
-    return text.format(C=chr(136), U=chr(134), I=chr(135))
+    cache = _render_cache
+    if cache is None:
+        return text.format(C=chr(136), U=chr(134), I=chr(135))
+    rendered = cache.get(text)
+    if rendered is None:
+        rendered = text.format(C=chr(136), U=chr(134), I=chr(135))
+        cache.put(text, rendered)
+    return rendered
 
 
 def escape_braces(string):
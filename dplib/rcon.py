@@ -0,0 +1,931 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module for talking to the server over UDP - rcon commands and status queries.
+
+The protocol has no request ids, so the packets received on a socket after sending a request are its response.
+A socket has at most one request in flight, :class:`RconClient` sends concurrent requests from many sockets.
+Long responses (sv players on a full server...) come in many `print` packets,
+they're joined until no packet comes for a short quiet period. The quiet period is waited for only
+after a packet long enough to be followed by another one, adding :data:`QUIET_PERIOD` to those responses.
+
+The server runs one command per rcon packet, so a batch of commands is sent as a burst of packets,
+each command followed by an `echo` of a unique marker, and the responses are split at the markers.
+
+Asynchronous requests can go through an :class:`RconScheduler`, which sends the most important ones first
+(moderation before state queries before chat) and no faster than the server can take them.
+Blocking calls (:class:`RconSocket`) are sent right away, they can't wait for a rate limit without blocking the caller.
+Identical read-only queries made at the same time can share one request with :class:`SingleFlight`.
+"""
+import asyncio
+from enum import IntEnum
+from heapq import heappop, heappush
+from itertools import count
+from socket import socket, getaddrinfo, timeout as SocketTimeout, AF_INET, SOCK_DGRAM
+from threading import Lock
+
+PACKET_HEADER = b'\xFF\xFF\xFF\xFF'
+# Connectionless packets start with this
+
+RCON_TIMEOUT = 3
+# Seconds to wait for a response
+
+PRINT_HEADER = PACKET_HEADER + b'print\n'
+# Every packet of a response starts with this
+
+BAD_PASSWORD = PRINT_HEADER + b'Bad rcon_password'
+# Response to every rcon packet with a wrong password, echoes included
+
+MAX_PACKET = 65536
+
+FULL_PACKET = 512
+# The server splits long responses into packets of about 1400 bytes,
+# a response may continue only after a packet at least this long
+
+QUIET_PERIOD = 0.05
+# Seconds without a packet after which a response is complete. Only a response whose last packet
+# is at least FULL_PACKET long waits for it, so such responses (sv players, status of a busy server,
+# long cvar lists) take this much longer than the round-trip. Shorter ones complete right away.
+
+RESPONSE_BUFFER_SIZE = 64 * 1024
+
+MAX_RCON_PACKET = 1400
+# Longer packets are dropped by the server
+
+RCON_RATE = 20
+# Packets per second sent by an RconScheduler
+
+RCON_BURST = 10
+# Packets an RconScheduler can send at once after being idle
+
+MAX_IDLE_ENDPOINTS = 4
+# UDP endpoints an RconClient keeps open between requests
+
+_batch_ids = count()
+
+
+def rcon_packet(password, command):
+    """
+    Builds an rcon packet.
+
+    :param password: rcon password
+    :param command: Console command
+
+    :rtype: bytes
+    """
+    return PACKET_HEADER + 'rcon {} {}\n'.format(password, command).encode('latin-1')
+
+
+STATUS_PACKET = PACKET_HEADER + b'status\n'
+
+
+class ResponseBuffer(object):
+    """
+    Preallocated buffer joining the packets of a response. Follow-up packets are added without their
+    `print` header, so the result looks like one big packet.
+
+    :param size: Initial size in bytes, the buffer grows if a response doesn't fit
+    :type size: int
+    """
+    __slots__ = ('data', 'length')
+
+    def __init__(self, size=RESPONSE_BUFFER_SIZE):
+        self.data = bytearray(size)
+        self.length = 0
+
+    def clear(self):
+        """
+        Empties the buffer for the next response, keeping the memory.
+        """
+        self.length = 0
+
+    def reserve(self):
+        """
+        Gets the free part of the buffer, big enough for any packet.
+
+        :rtype: memoryview
+        """
+        if len(self.data) - self.length < MAX_PACKET:
+            self.data.extend(bytes(MAX_PACKET))
+        return memoryview(self.data)[self.length:]
+
+    def commit(self, size):
+        """
+        Adds a packet written to :func:`ResponseBuffer.reserve`.
+
+        :param size: Size of the packet
+        :type size: int
+
+        :return: True if the response may continue in the next packet
+        :rtype: bool
+        """
+        start = self.length
+        data = self.data
+        if start:
+            if data[start:start + len(PRINT_HEADER)] != PRINT_HEADER:
+                # Not a part of the response, ignored
+                return True
+            data[start:start + size - len(PRINT_HEADER)] = data[start + len(PRINT_HEADER):start + size]
+            self.length += size - len(PRINT_HEADER)
+        else:
+            self.length = size
+        return size >= FULL_PACKET
+
+    def append(self, packet):
+        """
+        Adds a received packet.
+
+        :type packet: bytes
+
+        :return: True if the response may continue in the next packet
+        :rtype: bool
+        """
+        self.reserve()[:len(packet)] = packet
+        return self.commit(len(packet))
+
+    def getvalue(self):
+        """
+        :return: The response
+        :rtype: str
+        """
+        return str(memoryview(self.data)[:self.length], 'latin-1')
+
+
+class BatchCollector(object):
+    """
+    Splits the packets received after sending a batch into the responses to the commands.
+
+    The replies are expected in the order the packets were sent. UDP doesn't guarantee it, but the packets
+    of a batch go to the server at once over one route and the server answers them in the order they come,
+    so reordering is rare. If it happens, a reply may be taken for the response to the next command,
+    or, when two markers are swapped, the batch times out.
+
+    If the rcon password is wrong, the server only answers "Bad rcon_password.", so the first such reply
+    completes the batch with that reply as the response to every command.
+
+    :param markers: Markers echoed after each command
+    :type markers: list
+
+    :Attributes:
+
+        * bad_password - True if the server rejected the rcon password
+    """
+
+    def __init__(self, markers):
+        self.markers = markers
+        self.responses = []
+        self.bad_password = False
+        self.__buffer = ResponseBuffer()
+
+    @property
+    def done(self):
+        """
+        True if all the responses have been received.
+
+        :rtype: bool
+        """
+        return len(self.responses) == len(self.markers)
+
+    def add(self, packet):
+        """
+        Adds a received packet.
+
+        :type packet: bytes
+
+        :return: True if all the responses have been received
+        :rtype: bool
+        """
+        if self.done:
+            return True
+        if packet.startswith(BAD_PASSWORD):
+            self.bad_password = True
+            response = str(packet, 'latin-1')
+            self.responses.extend(response for marker in self.markers[len(self.responses):])
+            return True
+        if packet.startswith(PRINT_HEADER) and \
+                packet[len(PRINT_HEADER):].strip() == self.markers[len(self.responses)]:
+            self.responses.append(self.__buffer.getvalue())
+            self.__buffer.clear()
+            return self.done
+        self.__buffer.append(packet)
+        return False
+
+
+def batch_packets(password, commands):
+    """
+    Builds the packets of a batch, every command is followed by an echo of a unique marker.
+
+    :param password: rcon password
+    :param commands: Console commands
+    :type commands: list
+
+    :return: (packets, markers) tuple
+    :rtype: tuple
+
+    :raises ValueError: When a command is too long for one packet
+    """
+    batch_id = next(_batch_ids)
+    packets = []
+    markers = []
+    for i, command in enumerate(commands):
+        packet = rcon_packet(password, command)
+        if len(packet) > MAX_RCON_PACKET:
+            raise ValueError('Command too long for an rcon packet: %r' % command[:40])
+        marker = 'dplib-%d-%d' % (batch_id, i)
+        packets.append(packet)
+        packets.append(rcon_packet(password, 'echo %s' % marker))
+        markers.append(marker.encode('latin-1'))
+    return packets, markers
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of :class:`RconScheduler`, lower values are sent first.
+    """
+    MODERATION = 0
+    QUERY = 1
+    CHAT = 2
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, it can be shared by threads.
+
+    :param rate: Tokens added per second
+    :type rate: float
+    :param capacity: Max number of tokens
+    :type capacity: float
+    :param clock: Function returning the current time in seconds
+    """
+
+    def __init__(self, rate, capacity, clock):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.__tokens = capacity
+        self.__updated = clock()
+        self.__lock = Lock()
+
+    def __refill(self):
+        now = self.clock()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+
+    @property
+    def tokens(self):
+        """
+        Number of tokens available now.
+
+        :rtype: float
+        """
+        with self.__lock:
+            self.__refill()
+            return self.__tokens
+
+    def delay(self, cost=1):
+        """
+        Gets the time until cost tokens are available, a cost above the capacity counts as the capacity.
+
+        :param cost: Number of tokens
+        :type cost: float
+
+        :return: Seconds, 0 if the tokens are available now
+        :rtype: float
+        """
+        with self.__lock:
+            self.__refill()
+            missing = min(cost, self.capacity) - self.__tokens
+            return missing / self.rate if missing > 0 else 0
+
+    def take(self, cost=1):
+        """
+        Takes cost tokens, check :func:`TokenBucket.delay` first.
+
+        :param cost: Number of tokens
+        :type cost: float
+        """
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= min(cost, self.capacity)
+
+
+def query(address, packet, timeout=RCON_TIMEOUT):
+    """
+    Sends a packet from a new socket and waits for the response, blocking.
+    Use :class:`RconSocket` for many queries.
+
+    :param address: (hostname, port) tuple
+    :param packet: Packet to send
+    :type packet: bytes
+    :param timeout: Seconds to wait for the response
+    :type timeout: float
+
+    :return: Response
+    :rtype: str
+
+    :raises socket.timeout: When there's no response
+    """
+    sock = RconSocket(*address)
+    try:
+        return sock.query(packet, timeout)
+    finally:
+        sock.close()
+
+
+class RconSocket(object):
+    """
+    A long-lived connected UDP socket for blocking queries to one server.
+
+    The hostname is resolved once. The socket is created by the first query and re-created after an error
+    or a timeout, so a late response can't be taken for the response to the next query.
+    Queries from many threads are sent one after another.
+
+    Queries aren't rate-limited, waiting for a token would block the thread - the event loop thread, when called
+    from an event handler. Rate-limited requests go through an :class:`RconScheduler`.
+
+    :param hostname: Server hostname
+    :type hostname: str
+    :param port: Server port
+    :type port: int
+    :param quiet_period: Seconds without a packet after which a response is complete.
+        Responses ending with a packet of :data:`FULL_PACKET` bytes or more take this much longer.
+    :type quiet_period: float
+    """
+
+    def __init__(self, hostname, port, quiet_period=QUIET_PERIOD):
+        self.hostname = hostname
+        self.port = port
+        self.quiet_period = quiet_period
+        self.__address = None
+        self.__sock = None
+        self.__lock = Lock()
+        self.__buffer = ResponseBuffer()
+
+    @property
+    def address(self):
+        """
+        (ip, port) of the server, resolved on first use.
+
+        :rtype: tuple
+        """
+        if self.__address is None:
+            self.__address = getaddrinfo(self.hostname, self.port, AF_INET, SOCK_DGRAM)[0][4]
+        return self.__address
+
+    def query(self, packet, timeout=RCON_TIMEOUT):
+        """
+        Sends a packet and waits for the response.
+
+        :param packet: Packet to send
+        :type packet: bytes
+        :param timeout: Seconds to wait for the response
+        :type timeout: float
+
+        :return: Response
+        :rtype: str
+
+        :raises socket.timeout: When there's no response
+        """
+        with self.__lock:
+            sock = self.__socket()
+            buffer = self.__buffer
+            buffer.clear()
+            try:
+                sock.settimeout(timeout)
+                sock.send(packet)
+                more = buffer.commit(sock.recv_into(buffer.reserve()))
+                if more:
+                    sock.settimeout(self.quiet_period)
+                while more:
+                    try:
+                        more = buffer.commit(sock.recv_into(buffer.reserve()))
+                    except SocketTimeout:
+                        break
+            except OSError:
+                self.__sock = None
+                sock.close()
+                raise
+            return buffer.getvalue()
+
+    def batch(self, packets, markers, timeout=RCON_TIMEOUT):
+        """
+        Sends the packets of a batch at once and waits for all the responses, see :func:`batch_packets`.
+
+        :param packets: Packets to send
+        :type packets: list
+        :param markers: Markers echoed after each command
+        :type markers: list
+        :param timeout: Seconds to wait for each packet of the responses
+        :type timeout: float
+
+        :return: Responses, one per command
+        :rtype: list
+
+        :raises socket.timeout: When a response doesn't come
+        """
+        collector = BatchCollector(markers)
+        if collector.done:
+            return []
+        with self.__lock:
+            sock = self.__socket()
+            try:
+                sock.settimeout(timeout)
+                for packet in packets:
+                    sock.send(packet)
+                while not collector.add(sock.recv(MAX_PACKET)):
+                    pass
+            except OSError:
+                self.__sock = None
+                sock.close()
+                raise
+            if collector.bad_password:
+                # The replies to the rest of the batch are still coming
+                self.__sock = None
+                sock.close()
+        return collector.responses
+
+    def __socket(self):
+        sock = self.__sock
+        if sock is None:
+            sock = socket(AF_INET, SOCK_DGRAM)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+            self.__sock = sock
+        return sock
+
+    def close(self):
+        """
+        Closes the socket, the next query opens a new one.
+        """
+        with self.__lock:
+            if self.__sock is not None:
+                self.__sock.close()
+                self.__sock = None
+
+
+class RconProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol joining the received packets into the response to the current :class:`RconClient` request.
+
+    :param loop: Event loop
+    :param quiet_period: Seconds without a packet after which a response is complete
+    :type quiet_period: float
+    """
+
+    def __init__(self, loop, quiet_period=QUIET_PERIOD):
+        self.loop = loop
+        self.quiet_period = quiet_period
+        self.transport = None
+        self.waiter = None
+        self.__buffer = ResponseBuffer()
+        self.__timer = None
+        self.__batch = None
+
+    def expect(self, batch=None):
+        """
+        Starts collecting a response, or the responses to a batch.
+
+        :param batch: Collector of the responses to a batch
+        :type batch: :class:`BatchCollector`
+
+        :return: Future of the response (str), or of the list of responses to the batch
+        :rtype: asyncio.Future
+        """
+        self.reset()
+        self.__buffer.clear()
+        self.__batch = batch
+        self.waiter = asyncio.Future(loop=self.loop)
+        return self.waiter
+
+    def reset(self):
+        """
+        Stops collecting the response, the packets received later are dropped.
+        """
+        self.waiter = None
+        self.__batch = None
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+    def __complete(self):
+        self.__timer = None
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(self.__buffer.getvalue())
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        waiter = self.waiter
+        if waiter is None or waiter.done():
+            # A late response to a request that timed out
+            return
+        if self.__batch is not None:
+            if self.__batch.add(data):
+                waiter.set_result(self.__batch.responses)
+            return
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if self.__buffer.append(data):
+            self.__timer = self.loop.call_later(self.quiet_period, self.__complete)
+        else:
+            self.__complete()
+
+    def error_received(self, exc):
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(exc)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(exc or ConnectionError('Rcon endpoint closed'))
+        self.reset()
+
+
+class RconClient(object):
+    """
+    Asynchronous rcon and status client for one server, built on :func:`asyncio.BaseEventLoop.create_datagram_endpoint`.
+
+    Concurrent requests are sent at once, each from its own UDP endpoint, so the responses can't mix -
+    a response comes back to the port its request was sent from. Idle endpoints are reused.
+    A request is cancelled cleanly when the task awaiting it is, and its endpoint is closed,
+    so a late response can't be taken for the response to another request.
+
+    :param hostname: Server hostname
+    :type hostname: str
+    :param port: Server port
+    :type port: int
+    :param password: rcon password
+    :param loop: Event loop
+    :param quiet_period: Seconds without a packet after which a response is complete.
+        Responses ending with a packet of :data:`FULL_PACKET` bytes or more take this much longer.
+    :type quiet_period: float
+
+    :example:
+    .. code-block:: python
+        :linenos:
+
+        >>> from dplib.rcon import RconClient
+        >>> client = RconClient('127.0.0.1', 27910, 'hello', loop)
+        >>> response = yield from client.rcon('sv players', timeout=1)
+    """
+
+    def __init__(self, hostname, port, password, loop, quiet_period=QUIET_PERIOD):
+        self.hostname = hostname
+        self.port = port
+        self.password = password
+        self.loop = loop
+        self.quiet_period = quiet_period
+        self.__address = None
+        self.__idle = []
+        self.__open = set()
+
+    @property
+    def connected(self):
+        """
+        True if a UDP endpoint is open.
+
+        :rtype: bool
+        """
+        return any(protocol.transport is not None for protocol in self.__open)
+
+    @asyncio.coroutine
+    def connect(self):
+        """
+        Opens a UDP endpoint for the next request, if there's no idle one.
+        """
+        self.__release((yield from self.__acquire()))
+
+    @asyncio.coroutine
+    def __acquire(self):
+        """
+        Takes an idle UDP endpoint or opens a new one.
+
+        :rtype: :class:`RconProtocol`
+        """
+        while self.__idle:
+            protocol = self.__idle.pop()
+            if protocol.transport is not None:
+                return protocol
+            self.__open.discard(protocol)
+        if self.__address is None:
+            addresses = yield from self.loop.getaddrinfo(self.hostname, self.port, family=AF_INET, type=SOCK_DGRAM)
+            self.__address = addresses[0][4]
+        transport, protocol = yield from self.loop.create_datagram_endpoint(
+            lambda: RconProtocol(self.loop, self.quiet_period), remote_addr=self.__address)
+        self.__open.add(protocol)
+        return protocol
+
+    def __release(self, protocol):
+        """
+        Keeps an endpoint for the next request, or closes it if enough are idle.
+        """
+        if protocol.transport is None:
+            self.__open.discard(protocol)
+        elif len(self.__idle) < MAX_IDLE_ENDPOINTS:
+            self.__idle.append(protocol)
+        else:
+            self.__discard(protocol)
+
+    def __discard(self, protocol):
+        """
+        Closes an endpoint that may still receive packets for a request that has ended.
+        """
+        self.__open.discard(protocol)
+        if protocol.transport is not None:
+            protocol.transport.close()
+
+    def close(self):
+        """
+        Closes the UDP endpoints, the next request opens a new one.
+        """
+        for protocol in list(self.__open):
+            self.__discard(protocol)
+        self.__idle = []
+
+    @asyncio.coroutine
+    def request(self, packet, timeout=RCON_TIMEOUT):
+        """
+        Sends a packet and waits for the response.
+
+        :param packet: Packet to send
+        :type packet: bytes
+        :param timeout: Seconds to wait for the response, None to wait forever
+        :type timeout: float
+
+        :return: Response
+        :rtype: str
+
+        :raises asyncio.TimeoutError: When there's no response in time
+        """
+        return (yield from self.__send((packet,), None, timeout))
+
+    @asyncio.coroutine
+    def __send(self, packets, batch, timeout):
+        protocol = yield from self.__acquire()
+        waiter = protocol.expect(batch)
+        complete = False
+        try:
+            for packet in packets:
+                protocol.transport.sendto(packet)
+            response = yield from asyncio.wait_for(waiter, timeout, loop=self.loop)
+            # After a rejected password, the replies to the rest of the batch are still coming
+            complete = batch is None or not batch.bad_password
+            return response
+        finally:
+            protocol.reset()
+            if complete:
+                self.__release(protocol)
+            else:
+                self.__discard(protocol)
+
+    @asyncio.coroutine
+    def rcon(self, command, timeout=RCON_TIMEOUT):
+        """
+        Executes a console command.
+
+        :param command: Command
+        :param timeout: Seconds to wait for the response
+        :type timeout: float
+
+        :return: Response from server
+        :rtype: str
+        """
+        return (yield from self.request(rcon_packet(self.password, command), timeout))
+
+    @asyncio.coroutine
+    def batch(self, commands, timeout=RCON_TIMEOUT):
+        """
+        Executes many console commands in one round-trip, see :func:`batch_packets`.
+
+        :param commands: Commands
+        :type commands: list
+        :param timeout: Seconds to wait for all the responses
+        :type timeout: float
+
+        :return: Responses, one per command
+        :rtype: list
+        """
+        packets, markers = batch_packets(self.password, commands)
+        if not packets:
+            return []
+        return (yield from self.__send(packets, BatchCollector(markers), timeout))
+
+    @asyncio.coroutine
+    def status(self, timeout=RCON_TIMEOUT):
+        """
+        Executes status query.
+
+        :param timeout: Seconds to wait for the response
+        :type timeout: float
+
+        :return: Status string
+        :rtype: str
+        """
+        return (yield from self.request(STATUS_PACKET, timeout))
+
+
+class RconScheduler(object):
+    """
+    Outbound queue of asynchronous requests to one server, starting them by :class:`Priority`,
+    then in order of submission, while a :class:`TokenBucket` allows it.
+
+    Queries and chat are sent one at a time, so they reach the server in order and a burst of them
+    doesn't hog it. Moderation requests don't wait for them - a kick starts as soon as the bucket has
+    a token, even if a slow query is in flight. The requests run on their own endpoints
+    (see :class:`RconClient`), so the responses don't mix.
+
+    Cancelling the task awaiting a request cancels the request, whether it's queued or already sent,
+    so nothing runs for a caller that has gone.
+
+    :param rate: Packets per second
+    :type rate: float
+    :param burst: Packets sent at once after being idle
+    :type burst: float
+    :param loop: Event loop, its clock is used for the token bucket
+    :param bucket: Token bucket to use instead of a new one
+    :type bucket: :class:`TokenBucket`
+
+    :Attributes:
+
+        * bucket - the :class:`TokenBucket`
+    """
+
+    def __init__(self, rate=RCON_RATE, burst=RCON_BURST, loop=None, bucket=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.bucket = bucket or TokenBucket(rate, burst, self.loop.time)
+        self.__queue = []
+        self.__order = count()
+        self.__worker = None
+        self.__wakeup = None
+        self.__busy = None
+        self.__running = set()
+        self.__queued = {priority: 0 for priority in Priority}
+        self.__sent = {priority: 0 for priority in Priority}
+        self.__wait_total = {priority: 0.0 for priority in Priority}
+        self.__wait_max = {priority: 0.0 for priority in Priority}
+
+    @asyncio.coroutine
+    def submit(self, request, priority=Priority.QUERY, cost=1):
+        """
+        Queues a request and waits for its result.
+
+        :param request: Function returning a coroutine that sends the request
+        :param priority: Priority class
+        :type priority: :class:`Priority`
+        :param cost: Number of packets the request sends
+        :type cost: int
+
+        :return: Result of the request
+        """
+        future = asyncio.Future(loop=self.loop)
+        heappush(self.__queue, (priority, next(self.__order), self.loop.time(), cost, request, future))
+        self.__queued[priority] += 1
+        if self.__worker is None:
+            self.__worker = asyncio.ensure_future(self.__run(), loop=self.loop)
+        else:
+            self.__wake()
+        return (yield from future)
+
+    def __wake(self):
+        if self.__wakeup is not None and not self.__wakeup.done():
+            self.__wakeup.set_result(None)
+
+    @asyncio.coroutine
+    def __run(self):
+        queue = self.__queue
+        try:
+            while queue:
+                if queue[0][5].done():
+                    # Cancelled while waiting
+                    self.__queued[heappop(queue)[0]] -= 1
+                    continue
+                if queue[0][0] != Priority.MODERATION and self.__busy is not None:
+                    # Waits for the request in flight, or for something more important
+                    self.__wakeup = asyncio.Future(loop=self.loop)
+                    yield from self.__wakeup
+                    continue
+                delay = self.bucket.delay(queue[0][3])
+                if delay:
+                    # Something more important may come in the meantime, the head is checked again
+                    yield from asyncio.sleep(delay, loop=self.loop)
+                    continue
+                priority, order, queued_at, cost, request, future = heappop(queue)
+                self.__queued[priority] -= 1
+                self.bucket.take(cost)
+                wait = self.loop.time() - queued_at
+                self.__sent[priority] += 1
+                self.__wait_total[priority] += wait
+                self.__wait_max[priority] = max(self.__wait_max[priority], wait)
+                self.__start(priority, request, future)
+        finally:
+            self.__worker = None
+            self.__wakeup = None
+
+    def __start(self, priority, request, future):
+        """
+        Runs a request in a task bound to the future its caller awaits.
+        """
+        task = asyncio.ensure_future(request(), loop=self.loop)
+        self.__running.add(task)
+        if priority != Priority.MODERATION:
+            self.__busy = task
+        task.add_done_callback(lambda done: self.__finish(done, future))
+        future.add_done_callback(lambda done: task.cancel() if done.cancelled() else None)
+
+    def __finish(self, task, future):
+        self.__running.discard(task)
+        if self.__busy is task:
+            self.__busy = None
+            self.__wake()
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            if not future.done():
+                future.set_exception(task.exception())
+        elif not future.done():
+            future.set_result(task.result())
+
+    def metrics(self):
+        """
+        Gets the queue metrics.
+
+        :return: Dict with 'tokens' (available now), 'queued' (total queue depth), 'in_flight' (requests sent
+            and not answered yet) and one dict per priority class ('moderation', 'query', 'chat') with 'queued',
+            'sent', 'wait_avg' and 'wait_max' (seconds spent in the queue)
+        :rtype: dict
+        """
+        metrics = {'tokens': self.bucket.tokens, 'queued': len(self.__queue), 'in_flight': len(self.__running)}
+        for priority in Priority:
+            sent = self.__sent[priority]
+            metrics[priority.name.lower()] = {
+                'queued': self.__queued[priority],
+                'sent': sent,
+                'wait_avg': self.__wait_total[priority] / sent if sent else 0.0,
+                'wait_max': self.__wait_max[priority],
+            }
+        return metrics
+
+
+class SingleFlight(object):
+    """
+    Shares one in-flight request, and its result, between concurrent identical calls.
+    Cancelling one of the callers doesn't cancel the shared request.
+
+    :param loop: Event loop
+
+    :Attributes:
+
+        * started - number of requests made
+        * shared - number of calls served by a request made for another call
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.started = 0
+        self.shared = 0
+        self.__flights = {}
+
+    @asyncio.coroutine
+    def do(self, key, request):
+        """
+        Makes a request, or waits for the identical one in flight.
+
+        :param key: Hashable identifying the request
+        :param request: Function returning a coroutine that makes the request
+
+        :return: Result of the request, the same object for all the calls sharing it
+        """
+        flight = self.__flights.get(key)
+        if flight is None:
+            flight = self.__flights[key] = asyncio.ensure_future(request(), loop=self.loop)
+            flight.add_done_callback(lambda done: self.__land(key, done))
+            self.started += 1
+        else:
+            self.shared += 1
+        return (yield from asyncio.shield(flight, loop=self.loop))
+
+    def __land(self, key, flight):
+        if self.__flights.get(key) is flight:
+            del self.__flights[key]
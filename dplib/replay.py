@@ -0,0 +1,110 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module for replaying archived logs with a virtual clock
+"""
+import asyncio
+
+from dplib.events import log_time
+
+DAY = 24 * 60 * 60
+
+SETTLE_MAX_ITERATIONS = 100
+# Event loop iterations a replay step waits for the handlers to finish
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """
+    An event loop whose clock is driven by the replayed log instead of the wall clock.
+
+    Timers (asyncio.sleep, asyncio.wait_for timeouts, call_later) fire when the log time passes them,
+    so time-dependent handlers behave the same as they did live, only faster.
+
+    asyncio has no public API to inspect pending work, so the loop reads the ``_scheduled`` timer heap
+    and the ``_ready`` queue of :class:`asyncio.BaseEventLoop`. These are internals and may change
+    between Python versions.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(VirtualClockEventLoop, self).__init__(*args, **kwargs)
+        self.__time = 0.0
+
+    def time(self):
+        return self.__time
+
+    def __next_timer(self):
+        """
+        :return: Time of the earliest pending timer, None if there are no timers
+        :rtype: float
+        """
+        pending = [handle.when() for handle in self._scheduled if not handle.cancelled()]
+        return min(pending) if pending else None
+
+    @asyncio.coroutine
+    def settle(self):
+        """
+        Lets the other tasks run until there is nothing left to do at the current time.
+        """
+        for i in range(SETTLE_MAX_ITERATIONS):
+            yield from asyncio.sleep(0)
+            if not self._ready:
+                break
+
+    @asyncio.coroutine
+    def advance_to(self, when):
+        """
+        Moves the clock forward (never backwards), firing the timers due on the way in order.
+
+        :param when: Virtual time in seconds
+        :type when: float
+        """
+        while True:
+            yield from self.settle()
+            next_timer = self.__next_timer()
+            if next_timer is None or next_timer > when:
+                break
+            self.__time = max(self.__time, next_timer)
+        self.__time = max(self.__time, when)
+
+
+class LogClock(object):
+    """
+    Converts [HH:MM:SS] log timestamps to a monotonic number of seconds.
+    Timestamps have no date, so a jump back by more than 12 hours is taken as midnight.
+    """
+
+    def __init__(self):
+        self.__day = 0
+        self.__last = None
+
+    def __call__(self, line):
+        """
+        Gets the time of a log line.
+
+        :param line: Line from logs
+        :type line: str
+
+        :return: Seconds since midnight of the first day, None if the line has no timestamp
+        :rtype: int
+        """
+        seconds = log_time(line)
+        if seconds is None:
+            return None
+        if self.__last is not None and seconds < self.__last - DAY // 2:
+            self.__day += 1
+        self.__last = seconds
+        return self.__day * DAY + seconds
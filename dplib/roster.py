@@ -0,0 +1,430 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A module for keeping track of the players in game without asking the server all the time
+"""
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+
+from dplib.events import ServerEvent
+from dplib.parse import decode_ingame_text
+
+RECONCILE_INTERVAL = 60
+# Seconds between two sv players calls checking the roster
+
+MIN_RECONCILE_INTERVAL = 5
+# Unknown nicks don't make the roster ask the server more often than this
+
+PLAYERS_TTL = 2
+# Seconds a sv players response is reused for
+
+
+def normalize_nick(nick):
+    """
+    Normalizes a nick for lookups, removes the color codes and ignores case.
+
+    :param nick: Nick
+    :type nick: str
+
+    :rtype: str
+    """
+    return decode_ingame_text(nick).strip().lower()
+
+
+class Player(object):
+    """
+    Player info from sv players command, kept up to date by the :class:`Roster` as long as the player is in game
+
+    :Attributes:
+
+        * id - player's id (str)
+        * dplogin - dplogin.com account id, '' when Player has no account
+        * nick - nickname
+        * build - game build
+        * server - an instance of :class:`dplib.server.Server`
+        * team - 'Red', 'Blue', 'Yellow', 'Purple' or 'Observer', None if unknown
+        * score - score from the last :func:`dplib.server.Server.get_status` call, None if unknown
+        * ping - ping from the last :func:`dplib.server.Server.get_status` call, None if unknown
+        * alive - False after being eliminated, True after respawning, None if unknown
+    """
+    __slots__ = ('server', 'id', 'dplogin', 'nick', 'build', 'team', 'score', 'ping', 'alive')
+
+    def __init__(self, server, id, dplogin, nick, build, team=None, score=None, ping=None, alive=None):
+        self.server = server
+        self.id = id
+        self.dplogin = dplogin
+        self.nick = nick
+        self.build = build
+        self.team = team
+        self.score = score
+        self.ping = ping
+        self.alive = alive
+
+    def __repr__(self):
+        return 'Player(id=%r, dplogin=%r, nick=%r, build=%r, team=%r, score=%r, ping=%r, alive=%r)' % (
+            self.id, self.dplogin, self.nick, self.build, self.team, self.score, self.ping, self.alive)
+
+
+class Roster(object):
+    """
+    Nicks of the players in game, updated from the log events
+    (entrances, disconnects, name changes and team switches) and reconciled with `sv players` now and then.
+    The last `sv players` response is cached for `ttl` seconds, or until a player enters the game,
+    and indexed by nick, id, dplogin and normalized nick.
+    The :class:`Player` instances live as long as the players stay in game, they're updated in place
+    by the polls and the events (team, alive state).
+
+    :param fetch: Function asking the server for the players in game,
+        returning a list of (id, dplogin, nick, build) tuples of `sv players`
+    :param reconcile_interval: Seconds between two periodic reconciliations
+    :type reconcile_interval: float
+    :param min_reconcile_interval: Min seconds between two reconciliations asked for by :func:`Roster.check`
+    :type min_reconcile_interval: float
+    :param ttl: Seconds the players from the server are cached for, 0 to always ask
+    :type ttl: float
+    :param server: Server set as :attr:`Player.server`
+    :type server: :class:`dplib.server.Server`
+    """
+
+    def __init__(self, fetch, reconcile_interval=RECONCILE_INTERVAL, min_reconcile_interval=MIN_RECONCILE_INTERVAL,
+                 ttl=PLAYERS_TTL, server=None):
+        self.fetch = fetch
+        self.server = server
+        self.reconcile_interval = reconcile_interval
+        self.min_reconcile_interval = min_reconcile_interval
+        self.ttl = ttl
+        self.__fresh = False
+        self.__by_id = OrderedDict()
+        self.__by_nick = {}
+        self.__by_name = {}
+        self.__by_dplogin = {}
+        self.__nicks = set()
+        self.__reconciled = None
+        self.__last_try = None
+        self.__journal = None
+        self.__reconciling = None
+
+    @property
+    def nicks(self):
+        """
+        Nicks of the players in game.
+
+        :rtype: frozenset
+        """
+        return frozenset(self.__nicks)
+
+    @property
+    def reconciled(self):
+        """
+        Time of the last reconciliation (time.monotonic()), None if the roster was never reconciled.
+
+        :rtype: float
+        """
+        return self.__reconciled
+
+    def __contains__(self, nick):
+        return nick in self.__nicks
+
+    def __len__(self):
+        return len(self.__nicks)
+
+    def handle_event(self, event):
+        """
+        Updates the roster with an event from the log.
+
+        :param event: Event
+        :type event: :class:`dplib.events.Event`
+        """
+        if self.__journal is not None:
+            # A reconciliation is running, it will need to apply the event again
+            self.__journal.append(event)
+        self.__apply(event)
+
+    def __apply(self, event):
+        event_type = event.type
+        if event_type == ServerEvent.ENTRANCE:
+            self.__nicks.add(event.nick)
+            # The id of the new player is unknown until sv players is asked again
+            self.__fresh = False
+        elif event_type == ServerEvent.TEAM_SWITCHED:
+            self.__nicks.add(event.nick)
+            player = self.__by_nick.get(event.nick)
+            if player:
+                player.team = event.new_team
+                player.alive = False
+        elif event_type == ServerEvent.ELIM:
+            player = self.__by_nick.get(event.victim_nick)
+            if player:
+                player.alive = False
+        elif event_type == ServerEvent.RESPAWN:
+            player = self.__by_nick.get(event.nick)
+            if player:
+                player.team = event.team
+                player.alive = True
+        elif event_type == ServerEvent.DISCONNECT:
+            self.__nicks.discard(event.nick)
+            player = self.__by_nick.get(event.nick)
+            if player:
+                self.__unindex(player)
+        elif event_type == ServerEvent.NAMECHANGE:
+            self.__nicks.discard(event.old_nick)
+            self.__nicks.add(event.new_nick)
+            player = self.__by_nick.get(event.old_nick)
+            if player:
+                self.__unindex(player)
+                player.nick = event.new_nick
+                self.__index(player)
+
+    def __index(self, player):
+        self.__by_id[player.id] = player
+        self.__by_nick[player.nick] = player
+        self.__by_name[normalize_nick(player.nick)] = player
+        if player.dplogin:
+            self.__by_dplogin[player.dplogin] = player
+
+    def __unindex(self, player):
+        for index, key in ((self.__by_id, player.id), (self.__by_nick, player.nick),
+                           (self.__by_name, normalize_nick(player.nick)), (self.__by_dplogin, player.dplogin)):
+            if index.get(key) is player:
+                del index[key]
+
+    def __set_players(self, records, journal=()):
+        by_id = self.__by_id
+        players = []
+        for id, dplogin, nick, build in records:
+            player = by_id.get(id)
+            if player is not None and player.dplogin == dplogin and player.nick == nick:
+                # Still the same player, keeps the object and its state
+                player.build = build
+            else:
+                player = Player(self.server, id, dplogin, nick, build)
+            players.append(player)
+        self.__nicks = set(player.nick for player in players)
+        self.__by_id = OrderedDict()
+        self.__by_nick = {}
+        self.__by_name = {}
+        self.__by_dplogin = {}
+        for player in players:
+            self.__index(player)
+        self.__fresh = True
+        for event in journal:
+            self.__apply(event)
+        self.__reconciled = self.__last_try = monotonic()
+
+    def reconcile(self):
+        """
+        Replaces the roster with the players from the server, blocks for an rcon round-trip.
+        """
+        self.__set_players(self.fetch())
+
+    def invalidate(self):
+        """
+        Marks the cached players as outdated, the next lookup asks the server.
+        """
+        self.__fresh = False
+
+    def __stale(self):
+        return not self.__fresh or monotonic() - self.__reconciled >= self.ttl
+
+    def __refresh(self):
+        if self.__stale():
+            self.reconcile()
+
+    def get_players(self):
+        """
+        Gets the players in game, from the cache if it's fresh, from the server (blocking) otherwise.
+
+        :return: List of :class:`Player` instances
+        :rtype: list
+        """
+        self.__refresh()
+        return list(self.__by_id.values())
+
+    @asyncio.coroutine
+    def async_get_players(self, fetch, loop):
+        """
+        Gets the players in game, from the cache if it's fresh, from the server otherwise, see :func:`Roster.reconcile_async`.
+
+        :param fetch: Function returning a coroutine that asks the server for the players, like :attr:`Roster.fetch`
+        :param loop: Event loop
+
+        :return: List of :class:`Player` instances
+        :rtype: list
+        """
+        if self.__stale():
+            yield from self.reconcile_async(fetch, loop)
+        return list(self.__by_id.values())
+
+    def get_player(self, nick=None, id=None, dplogin=None, name=None):
+        """
+        Finds a player in constant time, refreshes the cache first like :func:`Roster.get_players`.
+        The indexes follow name changes and disconnects.
+
+        :param nick: Player's nick
+        :param id: Player's id
+        :param dplogin: Player's dplogin.com account id
+        :param name: Player's nick without color codes, case insensitive (see :func:`normalize_nick`)
+
+        :return: An instance of :class:`Player`, None if there's no such player
+        """
+        self.__refresh()
+        return self.__lookup(nick, id, dplogin, name)
+
+    @asyncio.coroutine
+    def async_get_player(self, fetch, loop, nick=None, id=None, dplogin=None, name=None):
+        """
+        Finds a player, refreshes the cache first like :func:`Roster.async_get_players`, see :func:`Roster.get_player`.
+
+        :param fetch: Function returning a coroutine that asks the server for the players, like :attr:`Roster.fetch`
+        :param loop: Event loop
+
+        :return: An instance of :class:`Player`, None if there's no such player
+        """
+        if self.__stale():
+            yield from self.reconcile_async(fetch, loop)
+        return self.__lookup(nick, id, dplogin, name)
+
+    def __lookup(self, nick, id, dplogin, name):
+        if nick is not None:
+            return self.__by_nick.get(nick)
+        if id is not None:
+            return self.__by_id.get(str(id))
+        if dplogin is not None:
+            return self.__by_dplogin.get(str(dplogin))
+        if name is not None:
+            return self.__by_name.get(normalize_nick(name))
+        raise TypeError('Player nick, id, dplogin or name is required.')
+
+    def update_status(self, entries):
+        """
+        Updates the scores and pings of the players in game, doesn't ask the server.
+
+        :param entries: (nick, score, ping) tuples from the status response, score and ping as ints
+        :type entries: iterable
+        """
+        by_nick = self.__by_nick
+        for nick, score, ping in entries:
+            player = by_nick.get(nick)
+            if player:
+                player.score = score
+                player.ping = ping
+
+    @asyncio.coroutine
+    def reconcile_async(self, fetch, loop):
+        """
+        Replaces the roster with the players from the server without blocking the loop.
+        Events handled in the meantime are applied on top of the fetched roster.
+        Reconciliations started while one is running wait for its result instead of asking the server again.
+
+        :param fetch: Function returning a coroutine that asks the server for the players, like :attr:`Roster.fetch`
+        :param loop: Event loop
+        """
+        if self.__reconciling is None:
+            self.__reconciling = asyncio.ensure_future(self.__reconcile_async(fetch), loop=loop)
+        yield from asyncio.shield(self.__reconciling, loop=loop)
+
+    @asyncio.coroutine
+    def __reconcile_async(self, fetch):
+        self.__journal = journal = []
+        try:
+            players = yield from fetch()
+        finally:
+            self.__journal = None
+            self.__reconciling = None
+        self.__set_players(players, journal)
+
+    @asyncio.coroutine
+    def reconcile_in_executor(self, loop):
+        """
+        Replaces the roster with the players from the server, fetched in the default executor of the loop
+        so the loop isn't blocked, see :func:`Roster.reconcile_async`.
+
+        :param loop: Event loop
+        """
+        yield from self.reconcile_async(lambda: loop.run_in_executor(None, self.fetch), loop)
+
+    @asyncio.coroutine
+    def keep_reconciled(self, loop):
+        """
+        Reconciles the roster every `reconcile_interval` seconds, until cancelled.
+        Failed reconciliations (rcon timeouts...) are retried at the next interval.
+
+        :param loop: Event loop
+        """
+        while True:
+            try:
+                yield from self.reconcile_in_executor(loop)
+            except OSError:
+                pass
+            yield from asyncio.sleep(self.reconcile_interval, loop=loop)
+
+    def check(self, *nicks):
+        """
+        Checks if players are in game. Unknown nicks make the roster reconcile (blocking),
+        at most once every `min_reconcile_interval` seconds, so a flood of fake nicks can't flood the server.
+        Use :func:`Roster.async_check` in the event loop.
+
+        :param nicks: Nicks to check
+
+        :rtype: bool
+        """
+        if all(nick in self.__nicks for nick in nicks):
+            return True
+        if not self.__may_reconcile():
+            return False
+        try:
+            self.reconcile()
+        except OSError:
+            return False
+        return all(nick in self.__nicks for nick in nicks)
+
+    @asyncio.coroutine
+    def async_check(self, nicks, fetch, loop):
+        """
+        Checks if players are in game without blocking the loop, see :func:`Roster.check`.
+        Unknown nicks wait for a reconciliation, shared with the other calls (see :func:`Roster.reconcile_async`).
+
+        :param nicks: Nicks to check
+        :type nicks: list
+        :param fetch: Function returning a coroutine that asks the server for the players, like :attr:`Roster.fetch`
+        :param loop: Event loop
+
+        :rtype: bool
+        """
+        if all(nick in self.__nicks for nick in nicks):
+            return True
+        if self.__reconciling is None and not self.__may_reconcile():
+            return False
+        try:
+            yield from self.reconcile_async(fetch, loop)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        return all(nick in self.__nicks for nick in nicks)
+
+    def __may_reconcile(self):
+        """
+        Throttles the reconciliations asked for by unknown nicks.
+
+        :return: True if it's been min_reconcile_interval since the last one
+        :rtype: bool
+        """
+        now = monotonic()
+        if self.__last_try is not None and now - self.__last_try < self.min_reconcile_interval:
+            return False
+        self.__last_try = now
+        return True
@@ -15,37 +15,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
-import select
 from collections import OrderedDict
 from enum import Enum
 from subprocess import Popen
+from threading import Lock
 import asyncio
-import os
-from socket import socket, AF_INET, SOCK_DGRAM
 from time import time
 
-from dplib.parse import render_text, decode_ingame_text
-
-
-class ServerEvent(Enum):
-    TIMEOUT = 0
-    CHAT = 1
-    ELIM = 2
-    RESPAWN = 3
-    MAPCHANGE = 4
-    DATE = 5
-    NAMECHANGE = 6
-    ENTRANCE = 7
-    FLAG_CAPTURED = 8
-    ELIM_TEAMS_FLAG = 9
-    ROUND_STARTED = 10
-    TEAM_SWITCHED = 11
-    DISCONNECT = 12
-    FLAG_GRAB = 13
-    FLAG_DROP = 14
-    ROUND_END = 15
-    GAMEMODE = 16
-    GAME_END = 17
+from dplib.events import ServerEvent, EVENT_CLASSES, make_event_class
+from dplib.logfile import LineSplitter, LogFile, LogScanner, PtyLog, MAX_LINE_LENGTH, is_compressed, iter_lines, \
+    scan_compressed
+from dplib.parse import render_text, decode_ingame_texts
+from dplib.rcon import RconClient, RconScheduler, RconSocket, Priority, SingleFlight, STATUS_PACKET, \
+    RCON_BURST, RCON_RATE, RCON_TIMEOUT, batch_packets, rcon_packet
+from dplib.replay import VirtualClockEventLoop, LogClock
+from dplib.roster import Player, Roster
 
 
 class GameMode(Enum):
@@ -71,98 +55,272 @@ class MapNotFoundError(Exception):
     pass
 
 
+class PlayerNotFoundError(Exception):
+    pass
+
+
 class ListenerType(Enum):
     PERMANENT = 0
     TRIGGER_ONCE = 1
 
 
-REGEXPS = OrderedDict([
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] (?:(?:\\[OBS\\] )|(?:\\[ELIM\\] ))?(.*?): (.*?)\r?\n'), ServerEvent.CHAT),
+LINE_PREFIX = re.compile('\\[\d\d:\d\d:\d\d\\] ')
+# Every event line starts with a timestamp, the patterns below match what follows it
+
+TEAMS = '((?:Red)|(?:Purple)|(?:Blue)|(?:Yellow))'
+
+EVENT_PATTERNS = OrderedDict([
+    # Event type: (keywords, pattern)
+    # A pattern is only tried on lines that contain one of its keywords, None means it's always tried.
+    # Patterns are tried in this order, a valid chat message stops the search.
+
+    (ServerEvent.CHAT, ((': ',), re.compile('(?:(?:\\[OBS\\] )|(?:\\[ELIM\\] ))?(.*?): (.*?)\r?\n'))),
     # [19:54:18] hTml: test
-    (re.compile(
-        '^\\[\d\d:\d\d:\d\d\\] \\*(.*?) (?:\\((.*?)\\) eliminated \\*(.*?) \\((.*?)\\)\\.\r?\n|'
-        'eliminated ((?:himself)|(?:herself)) with a paintgren\\.\r?\n)'), ServerEvent.ELIM),
+
+    (ServerEvent.ELIM, ((' eliminated ',), re.compile(
+        '\\*(.*?) (?:\\((.*?)\\) eliminated \\*(.*?) \\((.*?)\\)\\.\r?\n|'
+        'eliminated ((?:himself)|(?:herself)) with a paintgren\\.\r?\n)'))),
     # [18:54:24] *|ACEBot_1| (Spyder SE) eliminated *|herself| (Spyder SE).
     # [12:25:44] *whoa eliminated herself with a paintgren.
     # [12:26:09] *whoa eliminated himself with a paintgren.
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] \\*(.*?)\\\'s (.*?) revived!\r?\n'), ServerEvent.RESPAWN),
+    (ServerEvent.RESPAWN, ((' revived!',), re.compile('\\*(.*?)\\\'s (.*?) revived!\r?\n'))),
     # [19:03:57] *Red's ACEBot_6 revived!
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] (.*?) entered the game \\((.*?)\\) \\[(.*?)\\]\r?\n'), ServerEvent.ENTRANCE),
+    (ServerEvent.ENTRANCE, ((' entered the game (',), re.compile('(.*?) entered the game \\((.*?)\\) \\[(.*?)\\]\r?\n'))),
     # [19:03:57] mRokita entered the game (build 41)
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] \\*(.*?)\\\'s (.*?) returned the(?: \\*(.*?))? flag!\r?\n'), ServerEvent.FLAG_CAPTURED),
+    (ServerEvent.FLAG_CAPTURED, ((' returned the',), re.compile('\\*(.*?)\\\'s (.*?) returned the(?: \\*(.*?))? flag!\r?\n'))),
     # [18:54:24] *Red's hTml returned the *Blue flag!
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] \\*(.*?)\\\'s (.*?) earned (\d+) points for possesion of eliminated teams flag!\r?\n'),
-        ServerEvent.ELIM_TEAMS_FLAG),
+    (ServerEvent.ELIM_TEAMS_FLAG, ((' points for possesion',), re.compile(
+        '\\*(.*?)\\\'s (.*?) earned (\d+) points for possesion of eliminated teams flag!\r?\n'))),
     # [19:30:23] *Blue's mRokita earned 3 points for possesion of eliminated teams flag!
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] Round started\\.\\.\\.\r?\n'), ServerEvent.ROUND_STARTED),
+    (ServerEvent.ROUND_STARTED, (('Round started...',), re.compile('Round started\\.\\.\\.\r?\n'))),
     # [10:20:11] Round started...
 
-    (re.compile(
-        '(?:^\\[\d\d:\d\d:\d\d\\] (.*?) switched from \\*((?:Red)|(?:Purple)|(?:Blue)|(?:Yellow))'
-        ' to \\*((?:Red)|(?:Purple)|(?:Blue)|(?:Yellow))\\.\r?\n)|'
-        '(?:^\\[\d\d:\d\d:\d\d\\] (.*?) joined the \\*((?:Red)|(?:Purple)|(?:Blue)|(?:Yellow)) team\\.\r?\n)|'
-        '(?:^\\[\d\d:\d\d:\d\d\\] (.*?) is now (observing)?\\.\r?\n)'), ServerEvent.TEAM_SWITCHED),
+    (ServerEvent.TEAM_SWITCHED, ((' switched from *', ' joined the *', ' is now '), re.compile(
+        '(?:(.*?) switched from \\*' + TEAMS + ' to \\*' + TEAMS + '\\.\r?\n)|'
+        '(?:(.*?) joined the \\*' + TEAMS + ' team\\.\r?\n)|'
+        '(?:(.*?) is now (observing)?\\.\r?\n)'))),
     # [10:20:11] mRokita switched from Blue to Red.
     # [10:20:11] mRokita is now observing.
     # [10:20:11] mRokita is now observing.
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] [\t|-]{2}GameEnd[\t-](.*?)\r?\n'), ServerEvent.GAME_END),
+    (ServerEvent.GAME_END, (('GameEnd',), re.compile('[\t|-]{2}GameEnd[\t-](.*?)\r?\n'))),
     # [22:40:33]         GameEnd    441.9    No winner
     # [22:40:33]         GameEnd    1032.6    Red:23,Blue:22
     # [22:40:33]         GameEnd    4.9    DPBot01 wins!
     # [22:40:33]         GameEnd    42.9    Yellow:5,Blue:0,Purple:0,Red:0
     # [22:40:33]         GameEnd    42.9    Yellow:5,Blue:12,Purple:7
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] == Map Loaded: (.+) ==\r?\n'), ServerEvent.MAPCHANGE),
+    (ServerEvent.MAPCHANGE, (('== Map Loaded: ',), re.compile('== Map Loaded: (.+) ==\r?\n'))),
     # [10:20:11] == Map Loaded: airtime ==
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] (.*?) changed name to (.*?)\\.\r?\n'), ServerEvent.NAMECHANGE),
+    (ServerEvent.NAMECHANGE, ((' changed name to ',), re.compile('(.*?) changed name to (.*?)\\.\r?\n'))),
     # [19:54:54] name1 changed name to name2.
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] (.*?) disconnected\\.\r?\n'), ServerEvent.DISCONNECT),
+    (ServerEvent.DISCONNECT, ((' disconnected.',), re.compile('(.*?) disconnected\\.\r?\n'))),
     # [19:03:57] whoa disconnected.
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] \\*(.*?) got the(?: \\*(.*?))? flag\\!\r?\n'), ServerEvent.FLAG_GRAB),
+    (ServerEvent.FLAG_GRAB, ((' got the',), re.compile('\\*(.*?) got the(?: \\*(.*?))? flag\\!\r?\n'))),
     # [19:03:57] *whoa got the *Red flag!
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] \\*(.*?) dropped the flag\\!\r?\n'), ServerEvent.FLAG_DROP),
+    (ServerEvent.FLAG_DROP, ((' dropped the flag!',), re.compile('\\*(.*?) dropped the flag\\!\r?\n'))),
     # [19:03:57] *whoa dropped the flag!
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] (.*?) team wins the round\\!\r?\n'), ServerEvent.ROUND_END),
+    (ServerEvent.ROUND_END, ((' team wins the round!',), re.compile('(.*?) team wins the round\\!\r?\n'))),
     # [14:38:50] Blue team wins the round!
 
-    (re.compile('^\\[\d\d:\d\d:\d\d\\] === ((?:Deathmatch)|(?:Team Flag CTF)|(?:Single Flag CTF)|(?:Team Siege)|(?:Team Elim)|(?:Team Siege)|(?:Team Deathmatch)|(?:Team KOTH)|(?:Pong)) ===\r?\n'), ServerEvent.GAMEMODE),
+    (ServerEvent.GAMEMODE, (('=== ',), re.compile(
+        '=== ((?:Deathmatch)|(?:Team Flag CTF)|(?:Single Flag CTF)|(?:Team Siege)|(?:Team Elim)|(?:Team Siege)|'
+        '(?:Team Deathmatch)|(?:Team KOTH)|(?:Pong)) ===\r?\n'))),
     # [09:58:11] === Team Flag CTF ===
     # [13:16:19] === Team Siege ===
     # [21:53:54] === Pong ===
     # [12:21:05] === Deathmatch ===
 ])
 
+REGEXPS = OrderedDict((re.compile('^%s(?:%s)' % (LINE_PREFIX.pattern, pattern.pattern)), event_type)
+                      for event_type, (keywords, pattern) in EVENT_PATTERNS.items())
+# Deprecated, whole line pattern: event type, kept for compatibility - the server parses with EVENT_PATTERNS
 
-class Player(object):
+
+def _trie_pattern(words):
     """
-    Player info from sv players command
+    Builds a regexp matching any of the words, with the common prefixes factored out,
+    so it takes about the same time however many words there are. The longest word wins.
 
-    :Attributes:
+    :param words: Non-empty strings
+    :type words: iterable
 
-        * dplogin - dplogin.com account id, None when Player has no account
-        * nick - nickname:
-        * build - game build
-        * server - an instance of :class:`Server`
+    :rtype: str
     """
-    def __init__(self, server, id, dplogin, nick, build):
-        self.server = server
-        self.id = id
-        self.dplogin = dplogin
-        self.nick = nick
-        self.build = build
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        pattern = alternatives[0] if len(alternatives) == 1 else '(?:%s)' % '|'.join(alternatives)
+        if '' in node:
+            pattern = '(?:%s)?' % pattern
+        return pattern
+    return build(trie)
+
+
+class LineDispatcher(object):
+    """
+    Finds the events in log lines.
+
+    The timestamp is checked once per line, then a single scan for the keywords of all the patterns
+    picks the candidates, so a line is usually matched against one or two patterns instead of all of them.
+
+    :param patterns: OrderedDict of event type: (keywords, compiled pattern), like :const:`EVENT_PATTERNS`
+    """
+
+    def __init__(self, patterns):
+        self.__patterns = [(event_type, pattern) for event_type, (keywords, pattern) in patterns.items()]
+        always = []
+        by_keyword = {}
+        for i, (event_type, (keywords, pattern)) in enumerate(patterns.items()):
+            if not keywords:
+                always.append(i)
+            for keyword in keywords or ():
+                by_keyword.setdefault(keyword, []).append(i)
+        self.__always = tuple(always)
+        # Indexes of the patterns to try for a keyword, in pattern order.
+        # The scan finds the longest keyword at a position, so it stands for the keywords it starts with too.
+        self.__by_keyword = {}
+        for keyword in by_keyword:
+            indexes = set(always)
+            for prefix in by_keyword:
+                if keyword.startswith(prefix):
+                    indexes.update(by_keyword[prefix])
+            self.__by_keyword[keyword] = tuple(sorted(indexes))
+        # A lookahead finds overlapping keywords too, so a nick can't hide a keyword by eating its first char
+        self.__keywords = re.compile('(?=(%s))' % _trie_pattern(by_keyword)) if by_keyword else None
+
+    def candidates(self, line, pos=0):
+        """
+        Gets the patterns whose keywords occur in the line.
+
+        :param line: Line from logs
+        :type line: str
+        :param pos: Where to start looking
+        :type pos: int
+
+        :return: Indexes of the patterns, in pattern order
+        :rtype: tuple
+        """
+        if self.__keywords is None:
+            return self.__always
+        found = self.__keywords.findall(line, pos)
+        if not found:
+            return self.__always
+        if len(found) == 1:
+            return self.__by_keyword[found[0]]
+        indexes = set()
+        for keyword in found:
+            indexes.update(self.__by_keyword[keyword])
+        return sorted(indexes)
+
+    def match(self, line):
+        """
+        Matches the line with the candidate patterns, in order.
+
+        :param line: Line from logs
+        :type line: str
+
+        :return: List of (event type, args) tuples, args are shaped like the results of re.findall:
+            the matched text for patterns without groups, a string for one group, a tuple of strings for more.
+        :rtype: list
+        """
+        prefix = LINE_PREFIX.match(line)
+        if not prefix:
+            return []
+        pos = prefix.end()
+        matches = []
+        for i in self.candidates(line, pos):
+            event_type, pattern = self.__patterns[i]
+            m = pattern.match(line, pos)
+            if not m:
+                continue
+            groups = m.groups('')
+            if not groups:
+                args = line[:m.end()]
+            elif len(groups) == 1:
+                args = groups[0]
+            else:
+                args = groups
+            matches.append((event_type, args))
+        return matches
 
 
+LINES = LineDispatcher(EVENT_PATTERNS)
+
+
+def parse_line(line, dispatcher=LINES, event_classes=EVENT_CLASSES, nicks_valid=None):
+    """
+    Finds the events in a log line, without a server.
+
+    :param line: Line from logs
+    :type line: str
+    :param dispatcher: :class:`LineDispatcher` with the patterns to use
+    :param event_classes: Event classes of the event types, see :const:`dplib.events.EVENT_CLASSES`
+    :type event_classes: dict
+    :param nicks_valid: Called with the nick of a chat message to check if the player is in game.
+        A valid chat message is the last event of the line.
+        When None, nicks can't be checked, so a line is taken for a chat message only if no other pattern matches it
+        (any line with ": " looks like one, e.g. "== Map Loaded: airtime ==").
+
+    :return: List of events
+    :rtype: list
+    """
+    matches = dispatcher.match(line)
+    if not matches:
+        return []
+    # The dispatcher has checked the [HH:MM:SS] prefix already
+    timestamp = int(line[1:3]) * 3600 + int(line[4:6]) * 60 + int(line[7:9])
+    events = []
+    chat = None
+    for event_type, args in matches:
+        if event_type == ServerEvent.CHAT: # For security reasons
+            if nicks_valid is None:
+                # Unverified, used only if nothing else matches
+                chat = args
+            elif nicks_valid(args[0]):
+                events.append(event_classes[event_type].parse(args, timestamp))
+                break
+            continue
+        event = event_classes[event_type].parse(args, timestamp)
+        if event is not None:
+            events.append(event)
+    if chat is not None and not events:
+        events.append(event_classes[ServerEvent.CHAT].parse(chat, timestamp))
+    return events
+
+
+LOG_POLL_INTERVAL = 0.05
+# Seconds to sleep when the logfile is at EOF
+
+LOG_MAX_BATCH = 256 * 1024
+# Bytes read from the logfile in one wakeup
+
+
+@asyncio.coroutine
+def _ignore_event(**kwargs):
+    """
+    Default handler of custom events.
+    """
+    pass
+
 
 class Server(object):
     """
@@ -172,21 +330,39 @@ class Server(object):
     :type hostname: str
     :param port: Server port, default 27910
     :type port: int
-    :param logfile: Path to logfile
+    :param logfile: Path to logfile, compressed logs (.gz, .bz2, .xz) are decompressed on the fly
     :param rcon_password: rcon password
     :param pty_master: Master of the dp2 process (useful only if you want to run the server from your Python script). Go to the getting started section for details.
     :type pty_master: int
     :param init_vars: Send come commands used for security
+    :param rcon_rate: Packets per second sent by the asynchronous rcon methods, see :class:`dplib.rcon.RconScheduler`.
+        The blocking methods aren't rate-limited, see :func:`Server.rcon`.
+    :type rcon_rate: float
+    :param rcon_burst: Packets the asynchronous rcon methods can send at once after being idle
+    :type rcon_burst: float
+
+    :Attributes:
+
+        * roster - a :class:`dplib.roster.Roster` of the players in game
+        * loop - the event loop
     """
 
-    def __init__(self, hostname, port=27910, logfile=None, rcon_password=None, pty_master=None, init_vars=True):
+    def __init__(self, hostname, port=27910, logfile=None, rcon_password=None, pty_master=None, init_vars=True,
+                 rcon_rate=RCON_RATE, rcon_burst=RCON_BURST):
         self.__rcon_password = rcon_password
         self.__hostname = hostname
         self.__init_vars = init_vars
         self.__port = port
-        self.__log_file = None
+        self.__log = None
         self.__is_secure = False
         self.__alive = False
+        self.__replaying = False
+        self.__rcon_client = None
+        self.__rcon_scheduler = None
+        self.__single_flight = None
+        self.__rcon_rate = rcon_rate
+        self.__rcon_burst = rcon_burst
+        self.__rcon_socket = RconSocket(hostname, port)
         self.__logfile_name = logfile if not pty_master else None
         self.__pty_master = pty_master
 
@@ -226,6 +402,10 @@ class Server(object):
             ServerEvent.ROUND_END: [],
             ServerEvent.GAMEMODE: [],
         }
+        self.__patterns = EVENT_PATTERNS
+        self.__lines = LINES
+        self.__event_classes = dict(EVENT_CLASSES)
+        self.roster = Roster(self.__fetch_players, server=self)
         self.loop = asyncio.get_event_loop()
 
     def is_listening(self):
@@ -317,9 +497,13 @@ class Server(object):
         On game end, can be overriden using the :func:`.Server.event` decorator.
 
         :param score_blue: Blue's score - None if there was no Blue team.
+        :type score_blue: int
         :param score_red: Red's score - None if there was no Red team.
+        :type score_red: int
         :param score_yellow: Yellow's score - None if there was no Yellow team.
+        :type score_yellow: int
         :param score_purple: Purple's score - None if there was no Purple team.
+        :type score_purple: int
         """
         pass
 
@@ -453,172 +637,145 @@ class Server(object):
         else:
             raise Exception('Event \'%s\' doesn\'t exist' % func.__name__)
 
+    def register_event(self, event_type, pattern, keywords=None, fields=None, parser=None):
+        """
+        Registers a custom event, for lines the built-in events don't know (votes, admin messages, mods...).
+
+        The pattern is matched with what follows the timestamp and is only tried on lines containing one of
+        the keywords. All the keywords are found in a single scan of the line, so adding custom events
+        doesn't add a regexp search per line. Without keywords the pattern is tried on every line.
+
+        The event is handled by `on_<event_type>`, which can be overridden using the :func:`.Server.event`
+        decorator, and can be waited for with :func:`.Server.wait_for_event`.
+
+        :param event_type: Name of the event, for example 'vote_passed'
+        :type event_type: str
+        :param pattern: Regexp or its source
+        :param keywords: Strings found in every line matching the pattern
+        :type keywords: tuple
+        :param fields: Names of the event fields, the named groups of the pattern by default
+        :type fields: tuple
+        :param parser: Converts the groups matched (re.findall() results) to a tuple of the field values,
+            can return None to ignore the line, see :func:`dplib.events.make_event_class`
+
+        :return: The event class
+        :rtype: type
+
+        :example:
+        .. code-block:: python
+            :linenos:
+
+            >>> from dplib.server import Server
+            >>> s = Server(hostname='127.0.0.1', port=27910, logfile=r'qconsole27910.log', rcon_password='hello')
+            >>> s.register_event('vote_passed', 'Vote passed: (?P<command>.*?)\\r?\\n', keywords=('Vote passed: ',))
+            <class 'dplib.events.VotePassedEvent'>
+            >>> @s.event
+            ... def on_vote_passed(command):
+            ...     print(command)
+            ...
+            >>> s.run()
+            map airtime
+        """
+        if event_type in self.handlers:
+            raise ValueError('Event \'%s\' already exists' % event_type)
+        if not event_type.isidentifier():
+            raise ValueError('Invalid event name: %r' % event_type)
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        if isinstance(keywords, str):
+            keywords = (keywords,)
+        if keywords and not all(keywords):
+            raise ValueError('Keywords can\'t be empty')
+        if fields is None:
+            if pattern.groups != len(pattern.groupindex):
+                raise ValueError('Name all the groups of the pattern or pass the fields')
+            fields = sorted(pattern.groupindex, key=pattern.groupindex.get)
+        if parser is None and fields and len(fields) != pattern.groups:
+            raise ValueError('The pattern has %d groups but there are %d fields' % (pattern.groups, len(fields)))
+        event_class = make_event_class(event_type, fields, parser)
+
+        handler_name = 'on_' + event_type
+        if not hasattr(self, handler_name):
+            setattr(self, handler_name, _ignore_event)
+        patterns = OrderedDict(self.__patterns)
+        patterns[event_type] = (tuple(keywords) if keywords else None, pattern)
+        self.__patterns = patterns
+        self.__lines = LineDispatcher(patterns)
+        self.__event_classes[event_type] = event_class
+        self.__listeners[event_type] = []
+        self.handlers[event_type] = handler_name
+        return event_class
+
     def stop_listening(self):
         """
         Stop the main loop
         """
         self.__alive = False
+        if self.__log:
+            self.loop.call_soon_threadsafe(self.__log.wake)
 
-    def __perform_listeners(self, event_type, args, kwargs):
+    def __perform_listeners(self, event):
         """
         Performs all pending listeners.
 
-        :param event_type: Event type, one of members :class:`ServerEvent`
-        :param args: Event info
-        :type args: tuple
-        :param kwargs: Event info
-        :type kwargs: dict
+        :param event: Event info
+        :type event: :class:`dplib.events.Event`
         """
         to_remove = list()
-        for i, (check, future) in enumerate(self.__listeners[event_type]):
+        listeners = self.__listeners[event.type]
+        if not listeners:
+            return
+        args = event.check_args
+        for i, (check, future) in enumerate(listeners):
             if not future.cancelled() and not future.done():
                 if check(*args):
-                    future.set_result(kwargs)
+                    future.set_result(event)
             else:
                 to_remove.append(i)
         for i in reversed(to_remove):
-            self.__listeners[event_type].pop(i)
+            listeners.pop(i)
 
     def nicks_valid(self, *nicks):
-        nicks_ingame = [p.nick for p in self.get_players()]
-        for nick in nicks:
-            if nick not in nicks_ingame:
-                return False
-        return True
+        """
+        Checks if the players are in game, using :attr:`Server.roster`.
+        Unknown nicks make the roster ask the server (blocking), use :func:`Server.async_nicks_valid` in coroutines.
+        While replaying, there's no server to ask, only the players the roster saw entering in the log are valid.
+
+        :param nicks: Nicks to check
+
+        :rtype: bool
+        """
+        if self.__replaying:
+            return all(self.__nick_known(nick) for nick in nicks)
+        return self.roster.check(*nicks)
 
     @asyncio.coroutine
-    def __handle_event(self, event_type, args):
+    def async_nicks_valid(self, *nicks):
+        """
+        Checks if the players are in game without blocking the event loop, see :func:`Server.nicks_valid`.
+
+        :param nicks: Nicks to check
+
+        :rtype: bool
+        """
+        if self.__replaying:
+            return self.nicks_valid(*nicks)
+        return (yield from self.roster.async_check(nicks, self.__async_fetch_players, self.loop))
+
+    def __nick_known(self, nick):
+        return nick in self.roster
+
+    @asyncio.coroutine
+    def __handle_event(self, event):
         """
         Handles an event.
 
-        :param event_type: Event type, one of members :class:`ServerEvent`
-        :param args: Event info (re.findall() results)
-        """
-        kwargs = dict()
-        if event_type == ServerEvent.CHAT:
-            if args[0] not in [p.nick for p in self.get_players()]:
-                return
-            kwargs = {
-                'nick': args[0],
-                'message': args[1],
-            }
-            self.__perform_listeners(ServerEvent.CHAT, args, kwargs)
-        elif event_type == ServerEvent.ELIM:
-            kwargs = {
-                    'killer_nick': args[0],
-                    'killer_weapon': args[1],
-                    'victim_nick': args[2],
-                    'victim_weapon': args[3],
-                    'suicide': args[4],
-
-            }
-            self.__perform_listeners(ServerEvent.ELIM, args, kwargs)
-        elif event_type == ServerEvent.RESPAWN:
-            kwargs = {
-                'team': args[0],
-                'nick': args[1],
-            }
-            self.__perform_listeners(ServerEvent.RESPAWN, args, kwargs)
-        elif event_type == ServerEvent.ENTRANCE:
-            kwargs = {
-                'nick': args[0],
-                'build': args[1],
-                'addr': args[2],
-            }
-            self.__perform_listeners(ServerEvent.ENTRANCE, args, kwargs)
-        elif event_type == ServerEvent.FLAG_CAPTURED:
-            kwargs = {
-                'team': args[0],
-                'nick': args[1],
-                'flag': args[2],
-            }
-            self.__perform_listeners(ServerEvent.FLAG_CAPTURED, args, kwargs)
-        elif event_type == ServerEvent.ELIM_TEAMS_FLAG:
-            kwargs = {
-                'team': args[0],
-                'nick': args[1],
-                'points': int(args[2]),
-            }
-            self.__perform_listeners(ServerEvent.ELIM_TEAMS_FLAG, args, kwargs)
-        elif event_type == ServerEvent.ROUND_STARTED:
-            kwargs = dict()
-            self.__perform_listeners(ServerEvent.ROUND_STARTED, args, kwargs)
-        elif event_type == ServerEvent.TEAM_SWITCHED:
-            new_args = tuple([arg for arg in args if arg])
-            kwargs = {
-                'nick': new_args[0],
-                'old_team': new_args[1] if len(new_args) > 2 else 'Observer',
-                'new_team': new_args[2] if len(new_args) > 2 else new_args[1]
-            }
-            if kwargs['new_team'] == 'observing':
-                kwargs['new_team'] = 'Observer'
-                kwargs['old_team'] = None
-            self.__perform_listeners(ServerEvent.TEAM_SWITCHED, new_args, kwargs)
-        elif event_type == ServerEvent.GAME_END:
-            kwargs = {
-                'score_blue': None,
-                'score_red': None,
-                'score_purple': None,
-                'score_yellow': None,
-            }
-            teams = args.split(',')
-            for t in teams:
-                data = t.split(':')
-                if data[0] == 'Blue':
-                    kwargs['score_blue'] = data[1]
-                elif data[0] == 'Red':
-                    kwargs['score_red'] = data[1]
-                elif data[0] == 'Yellow':
-                    kwargs['score_yellow'] = data[1]
-                elif data[0] == 'Purple':
-                    kwargs['score_purple'] = data[1]
-            self.__perform_listeners(ServerEvent.GAME_END,
-                                     (kwargs['score_blue'],
-                                      kwargs['score_red'],
-                                      kwargs['score_yellow'],
-                                      kwargs['score_purple']), kwargs)
-        elif event_type == ServerEvent.MAPCHANGE:
-            kwargs = {
-                'mapname': args
-            }
-            self.__perform_listeners(ServerEvent.MAPCHANGE, (kwargs['mapname'],), kwargs)
-        elif event_type == ServerEvent.NAMECHANGE:
-            kwargs = {
-                'old_nick': args[0],
-                'new_nick': args[1]
-            }
-            self.__perform_listeners(ServerEvent.NAMECHANGE, (kwargs['old_nick'], kwargs['new_nick']), kwargs)
-
-        elif event_type == ServerEvent.DISCONNECT:
-            kwargs = {
-                'nick': args
-            }
-            self.__perform_listeners(ServerEvent.DISCONNECT, (kwargs['nick'],), kwargs)
-
-        elif event_type == ServerEvent.FLAG_GRAB:
-            kwargs = {
-                'nick': args[0],
-                'flag': args[1],
-            }
-            self.__perform_listeners(ServerEvent.FLAG_GRAB, (kwargs['nick'], kwargs['flag']), kwargs)
-
-        elif event_type == ServerEvent.FLAG_DROP:
-            kwargs = {
-                'nick': args
-            }
-            self.__perform_listeners(ServerEvent.FLAG_GRAB, (kwargs['nick'],), kwargs)
-
-        elif event_type == ServerEvent.ROUND_END:
-            kwargs = dict()
-            self.__perform_listeners(ServerEvent.ROUND_END, args, kwargs)
-
-        elif event_type == ServerEvent.GAMEMODE:
-            kwargs = {
-                'gamemode': args
-            }
-            self.__perform_listeners(ServerEvent.GAMEMODE, args, kwargs)
-
-        asyncio.ensure_future(self.get_event_handler(event_type)(**kwargs))
+        :param event: Event info
+        :type event: :class:`dplib.events.Event`
+        """
+        self.roster.handle_event(event)
+        self.__perform_listeners(event)
+        asyncio.ensure_future(self.get_event_handler(event.type)(**event))
 
     def get_event_handler(self, event_type):
         return getattr(self, self.handlers[event_type])
@@ -626,25 +783,44 @@ class Server(object):
     @asyncio.coroutine
     def __parse_line(self, line):
         """
-        Tries to match line with all event regexps.
+        Finds the events in the line and handles them, see :func:`parse_line`.
 
         :param line: Line from logs
         """
-        for r in REGEXPS:
-            results = r.findall(line)
-            e = REGEXPS[r]
-            for res in results:
-                if e == ServerEvent.CHAT: # For security reasons
-                    if self.nicks_valid(res[0]):
-                        yield from self.__handle_event(event_type=e, args=res)
-                        return
-                    else:
-                        continue
-                yield from self.__handle_event(event_type=e, args=res)
-
-    def rcon(self, command, socket_timeout=3):
+        if self.__replaying:
+            events = parse_line(line, self.__lines, self.__event_classes, self.__nick_known)
+            if not events:
+                # Players who entered before the log started aren't known, their chat is taken
+                # if the line is nothing else
+                events = parse_line(line, self.__lines, self.__event_classes)
+            for event in events:
+                yield from self.__handle_event(event)
+            return
+        unknown = []
+
+        def nick_known(nick):
+            if self.__nick_known(nick):
+                return True
+            unknown.append(nick)
+            return False
+
+        events = parse_line(line, self.__lines, self.__event_classes, nick_known)
+        for nick in unknown:
+            # Maybe a player the roster hasn't seen yet, waits for it to be reconciled
+            if (yield from self.async_nicks_valid(nick)):
+                events = parse_line(line, self.__lines, self.__event_classes, self.__nick_known)
+                break
+        for event in events:
+            yield from self.__handle_event(event)
+
+    def rcon(self, command, socket_timeout=RCON_TIMEOUT):
         """
         Execute a console command using RCON.
+        Blocks until the response comes, use :func:`Server.async_rcon` in coroutines.
+
+        Blocking calls aren't rate-limited, waiting for the limit would stall the event loop when called
+        from a handler. Use the asynchronous methods (:func:`Server.async_rcon`, :func:`Server.async_say`...)
+        in handlers, they're queued by priority and rate-limited.
 
         :param command: Command
         :param socket_timeout: Timeout for the UDP socket.
@@ -663,12 +839,42 @@ class Server(object):
             'ÿÿÿÿprint\\n mRokita [127.0.0.1:9419]\\nadmin is listing IP for mRokita [127.0.0.1:9419]\\n'
 
         """
-        sock = socket(AF_INET, SOCK_DGRAM)
-        sock.connect((self.__hostname, self.__port))
-        sock.settimeout(socket_timeout)
-        sock.send(bytes('\xFF\xFF\xFF\xFFrcon {} {}\n'.format(self.__rcon_password, command).encode('latin-1')))
-        ret = sock.recv(2048).decode('latin-1')
-        return ret
+        if self.__replaying:
+            # Don't touch a live server while replaying a log
+            return ''
+        return self.__rcon_socket.query(rcon_packet(self.__rcon_password, command), socket_timeout)
+
+    def rcon_batch(self, commands, socket_timeout=RCON_TIMEOUT):
+        """
+        Execute many console commands in one round-trip.
+        The commands are sent at once, each in its own packet (the server runs one command per rcon packet),
+        and the responses are split back per command.
+
+        The split relies on the replies coming in the order the packets were sent, which UDP doesn't guarantee.
+        The packets of a batch are sent at once to one server, so they're rarely reordered, but if they are,
+        a response may be returned for the wrong command. Use :func:`Server.rcon` where that matters.
+        If the rcon password is wrong, every response is the "Bad rcon_password." reply.
+
+        :param commands: Commands
+        :type commands: list
+        :param socket_timeout: Timeout for the UDP socket.
+
+        :return: Responses from server, one per command
+        :rtype: list
+
+        :raises ValueError: When a command is too long for an rcon packet
+
+        :example:
+        .. code-block:: python
+            :linenos:
+
+            >>> s.rcon_batch(['set elim 10', 'set timelimit 10'])
+            ['ÿÿÿÿprint\\n', 'ÿÿÿÿprint\\n']
+        """
+        if self.__replaying:
+            return ['' for command in commands]
+        packets, markers = batch_packets(self.__rcon_password, commands)
+        return self.__rcon_socket.batch(packets, markers, socket_timeout)
 
     def status(self):
         """
@@ -677,11 +883,116 @@ class Server(object):
         :return: Status string
         :rtype: str
         """
-        sock = socket(AF_INET, SOCK_DGRAM)
-        sock.connect((self.__hostname, self.__port))
-        sock.settimeout(3)
-        sock.send(b'\xFF\xFF\xFF\xFFstatus\n')
-        return sock.recv(2048).decode('latin-1')
+        if self.__replaying:
+            return ''
+        return self.__rcon_socket.query(STATUS_PACKET)
+
+    @property
+    def rcon_client(self):
+        """
+        The :class:`dplib.rcon.RconClient` used by the asynchronous rcon methods, bound to :attr:`Server.loop`.
+        """
+        client = self.__rcon_client
+        if client is None or client.loop is not self.loop:
+            if client is not None:
+                client.close()
+            client = self.__rcon_client = RconClient(self.__hostname, self.__port, self.__rcon_password, self.loop)
+        return client
+
+    @property
+    def rcon_scheduler(self):
+        """
+        The :class:`dplib.rcon.RconScheduler` the asynchronous rcon methods go through, bound to :attr:`Server.loop`.
+        Its :func:`dplib.rcon.RconScheduler.metrics` show the queue depth and wait times.
+        """
+        scheduler = self.__rcon_scheduler
+        if scheduler is None or scheduler.loop is not self.loop:
+            scheduler = self.__rcon_scheduler = RconScheduler(self.__rcon_rate, self.__rcon_burst, self.loop)
+        return scheduler
+
+    @property
+    def single_flight(self):
+        """
+        The :class:`dplib.rcon.SingleFlight` shared by the concurrent identical calls of
+        :func:`Server.async_get_status` and :func:`Server.async_get_cvar`, bound to :attr:`Server.loop`.
+        Its started and shared counters show how many queries were saved.
+        """
+        flights = self.__single_flight
+        if flights is None or flights.loop is not self.loop:
+            flights = self.__single_flight = SingleFlight(self.loop)
+        return flights
+
+    @asyncio.coroutine
+    def async_rcon(self, command, timeout=RCON_TIMEOUT, priority=Priority.QUERY):
+        """
+        Execute a console command using RCON without blocking the event loop.
+        Requests are sent by priority and rate-limited, see :class:`dplib.rcon.RconScheduler`.
+        Cancelling the task awaiting the response cancels the request.
+
+        :param command: Command
+        :param timeout: Seconds to wait for the response, None to wait forever (the time spent in the queue isn't counted)
+        :type timeout: float
+        :param priority: Priority class
+        :type priority: :class:`dplib.rcon.Priority`
+
+        :return: Response from server
+        :rtype: str
+
+        :raises asyncio.TimeoutError: When there's no response in time
+
+        :example:
+        .. code-block:: python
+            :linenos:
+
+            >>> @s.event
+            ... def on_mapchange(mapname):
+            ...     players = yield from s.async_rcon('sv players', timeout=1)
+        """
+        if self.__replaying:
+            return ''
+        client = self.rcon_client
+        return (yield from self.rcon_scheduler.submit(lambda: client.rcon(command, timeout), priority))
+
+    @asyncio.coroutine
+    def async_rcon_batch(self, commands, timeout=RCON_TIMEOUT, priority=Priority.QUERY):
+        """
+        Execute many console commands in one round-trip without blocking the event loop, see :func:`Server.rcon_batch`.
+
+        :param commands: Commands
+        :type commands: list
+        :param timeout: Seconds to wait for all the responses, None to wait forever
+        :type timeout: float
+        :param priority: Priority class
+        :type priority: :class:`dplib.rcon.Priority`
+
+        :return: Responses from server, one per command
+        :rtype: list
+
+        :raises asyncio.TimeoutError: When the responses don't come in time
+        """
+        if self.__replaying:
+            return ['' for command in commands]
+        client = self.rcon_client
+        return (yield from self.rcon_scheduler.submit(lambda: client.batch(commands, timeout), priority,
+                                                      cost=2 * len(commands)))
+
+    @asyncio.coroutine
+    def async_status(self, timeout=RCON_TIMEOUT):
+        """
+        Execute status query without blocking the event loop.
+
+        :param timeout: Seconds to wait for the response, None to wait forever
+        :type timeout: float
+
+        :return: Status string
+        :rtype: str
+
+        :raises asyncio.TimeoutError: When there's no response in time
+        """
+        if self.__replaying:
+            return ''
+        client = self.rcon_client
+        return (yield from self.rcon_scheduler.submit(lambda: client.status(timeout), Priority.QUERY))
 
     def new_map(self, map_name, gamemode=None):
         """
@@ -712,9 +1023,7 @@ class Server(object):
 
         """
         if ip:
-            resp = self.rcon('addip %s' % ip)
-            resp += '\n' + self.rcon('writeban')
-            return resp
+            return '\n'.join(self.rcon_batch(['addip %s' % ip, 'writeban']))
         else:
             raise TypeError('IP address is required.')
 
@@ -728,9 +1037,7 @@ class Server(object):
         :rtype: str
         """
         if ip:
-            resp = self.rcon('removeip %s' % ip)
-            resp += '\n' + self.rcon('writeban')
-            return resp
+            return '\n'.join(self.rcon_batch(['removeip %s' % ip, 'writeban']))
         else:
             raise TypeError('IP address is required.')
 
@@ -744,16 +1051,48 @@ class Server(object):
 
         :return: Rcon response
         :rtype: str
+
+        :raises PlayerNotFoundError: When there's no player with the nick in game
         """
+        self.__check_duration(duration)
+        if nick:
+            id = self.__player_id(self.get_ingame_info(nick), nick)
+        return self.rcon(self.__tempoban_command(id, duration))
+
+    @asyncio.coroutine
+    def async_tempoban(self, id=None, nick=None, duration=3):
+        """
+        Temporarily bans a player without blocking the event loop, sent before queries and chat,
+        see :func:`Server.tempoban`. The nick is looked up with :func:`Server.async_get_ingame_info`.
+
+        :return: Rcon response
+        :rtype: str
+
+        :raises PlayerNotFoundError: When there's no player with the nick in game
+        """
+        self.__check_duration(duration)
+        if nick:
+            id = self.__player_id((yield from self.async_get_ingame_info(nick)), nick)
+        return (yield from self.async_rcon(self.__tempoban_command(id, duration), priority=Priority.MODERATION))
+
+    @staticmethod
+    def __check_duration(duration):
         if type(duration) != int:
             raise TypeError('Ban duration should be an integer, not a ' + str(type(duration)))
-        if nick:
-            id = self.get_ingame_info(nick).id
+
+    @staticmethod
+    def __tempoban_command(id, duration):
         if id:
-            return self.rcon('tban %s %s' % (id, str(duration)))
+            return 'tban %s %s' % (id, str(duration))
         else:
             raise TypeError('Player id or nick is required.')
 
+    @staticmethod
+    def __player_id(player, nick):
+        if player is None:
+            raise PlayerNotFoundError('Player %s is not in game.' % nick)
+        return player.id
+
     def remove_tempobans(self):
         """
         Removes all temporary bans
@@ -772,11 +1111,32 @@ class Server(object):
 
         :return: Rcon response
         :rtype: str
+
+        :raises PlayerNotFoundError: When there's no player with the nick in game
+        """
+        if nick:
+            id = self.__player_id(self.get_ingame_info(nick), nick)
+        return self.rcon(self.__kick_command(id))
+
+    @asyncio.coroutine
+    def async_kick(self, id=None, nick=None):
+        """
+        Kicks a player without blocking the event loop, sent before queries and chat, see :func:`Server.kick`.
+        The nick is looked up with :func:`Server.async_get_ingame_info`.
+
+        :return: Rcon response
+        :rtype: str
+
+        :raises PlayerNotFoundError: When there's no player with the nick in game
         """
         if nick:
-            id = self.get_ingame_info(nick).id
+            id = self.__player_id((yield from self.async_get_ingame_info(nick)), nick)
+        return (yield from self.async_rcon(self.__kick_command(id), priority=Priority.MODERATION))
+
+    @staticmethod
+    def __kick_command(id):
         if id:
-            return self.rcon('kick %s' % id)
+            return 'kick %s' % id
         else:
             raise TypeError('Player id or nick is required.')
 
@@ -807,6 +1167,17 @@ class Server(object):
         """
         return self.rcon('say "%s"' % render_text(message))
 
+    @asyncio.coroutine
+    def async_say(self, message):
+        """
+        Say a message without blocking the event loop, sent after moderation and queries, see :func:`Server.say`.
+        Use it for announcements from event handlers, so bursts of events can't flood the server.
+
+        :rtype: str
+        :return: Rcon response
+        """
+        return (yield from self.async_rcon('say "%s"' % render_text(message), priority=Priority.CHAT))
+
     def cprint(self, message):
         """
         Cprints a message.
@@ -819,6 +1190,16 @@ class Server(object):
         """
         return self.rcon('sv cprint "%s"' % render_text(message))
 
+    @asyncio.coroutine
+    def async_cprint(self, message):
+        """
+        Cprints a message without blocking the event loop, sent after moderation and queries, see :func:`Server.cprint`.
+
+        :rtype: str
+        :return: Rcon response
+        """
+        return (yield from self.async_rcon('sv cprint "%s"' % render_text(message), priority=Priority.CHAT))
+
     def set_cvar(self, var, value):
         """
         Set a server cvar
@@ -841,7 +1222,43 @@ class Server(object):
         :return: Cvar value
         :rtype: str
         """
-        res = self.rcon('"%s"' % var)
+        return self.__parse_cvar(var, self.rcon('"%s"' % var))
+
+    def get_cvars(self, *variables):
+        """
+        Gets the values of many cvars in one round-trip
+
+        :param variables: Variable names
+
+        :return: Cvar values
+        :rtype: list
+        """
+        responses = self.rcon_batch(['"%s"' % var for var in variables])
+        return [self.__parse_cvar(var, res) for var, res in zip(variables, responses)]
+
+    @asyncio.coroutine
+    def async_get_cvar(self, var):
+        """
+        Gets cvar value without blocking the event loop, see :func:`Server.get_cvar`.
+        Concurrent calls for the same cvar share one request.
+
+        :param var: Variable name
+        :type var: str
+
+        :return: Cvar value
+        :rtype: str
+        """
+        return (yield from self.single_flight.do(('cvar', var), lambda: self.__fetch_cvar(var)))
+
+    @asyncio.coroutine
+    def __fetch_cvar(self, var):
+        return self.__parse_cvar(var, (yield from self.async_rcon('"%s"' % var)))
+
+    @staticmethod
+    def __parse_cvar(var, res):
+        if not res:
+            # Nothing is sent while replaying, see Server.rcon
+            return ''
         if re.match('^....print\\\nUnknown command \\"%s"\\.\\\n' % re.escape(var), res):
             raise NameError('Cvar "%s" does not exist' % var)
         return re.findall('^....print\\\n\\"%s\\" is \\"(.*?)\\"\\\n' % re.escape(var), res)[0]
@@ -1159,7 +1576,7 @@ class Server(object):
         :rtype: dict
         """
         future = asyncio.Future(loop=self.loop)
-        margs = (nick)
+        margs = (nick,)
         predicate = self.__get_predicate(margs, check)
         self.__listeners[ServerEvent.FLAG_DROP].append((predicate, future))
         try:
@@ -1169,7 +1586,39 @@ class Server(object):
             data = None
         return data
 
-    def start(self, scan_old=False, realtime=True, debug=False):
+    @asyncio.coroutine
+    def wait_for_event(self, event_type, timeout=None, check=None, **values):
+        """
+        Waits for any event, built-in or registered with :func:`.Server.register_event`.
+
+        :param event_type: Event type, one of members :class:`ServerEvent` or the name of a custom event
+        :param timeout: Time to wait for event, if exceeded, returns None.
+        :param check: Check function, called with the fields of the event, ignored if None.
+        :param values: Field values to match, for example nick='mRokita'
+
+        :return: The event
+        :rtype: :class:`dplib.events.Event`
+        """
+        if event_type not in self.__event_classes:
+            raise ValueError('Event \'%s\' doesn\'t exist' % event_type)
+        event_class = self.__event_classes[event_type]
+        check_fields = event_class.check_fields or event_class.fields
+        for name in values:
+            if name not in check_fields:
+                raise TypeError('wait_for_event() got an unexpected field \'%s\'' % name)
+        future = asyncio.Future(loop=self.loop)
+        margs = tuple(values.get(name) for name in check_fields)
+        predicate = self.__get_predicate(margs, check)
+        self.__listeners[event_type].append((predicate, future))
+        try:
+            data = yield from asyncio.wait_for(future, timeout,
+                                               loop=self.loop)
+        except asyncio.TimeoutError:
+            data = None
+        return data
+
+    def start(self, scan_old=False, realtime=True, debug=False, max_batch=LOG_MAX_BATCH, use_inotify=True,
+              checkpoint_file=None, scan_tail=None, scan_since=None, max_line_length=MAX_LINE_LENGTH):
         """
         Main loop.
 
@@ -1177,69 +1626,241 @@ class Server(object):
         :type scan_old: bool
         :param realtime: Wait for incoming logfile data
         :type realtime: bool
+        :param max_batch: Maximum number of bytes read from the log in one wakeup.
+            Everything available is drained in chunks of this size and the loop sleeps only at EOF,
+            so a big burst of events is ingested at once without starving other tasks.
+        :type max_batch: int
+        :param use_inotify: Wake up only when the logfile is modified (Linux only), poll the logfile otherwise
+        :type use_inotify: bool
+        :param checkpoint_file: Path to a file where the logfile offset is periodically saved.
+            If the file exists, reading resumes from the saved offset, so a restarted bot handles only the new lines.
+        :type checkpoint_file: str
+        :param scan_tail: Handle events from the last scan_tail bytes of the logfile before waiting for new data.
+            Ignored when resuming from a checkpoint.
+        :type scan_tail: int
+        :param scan_since: Handle events logged since this time (HH:MM:SS) before waiting for new data.
+            Ignored when resuming from a checkpoint.
+            Compressed logfiles have to be decompressed from the start to find the lines to scan.
+        :type scan_since: str
+        :param max_line_length: Longer log lines are dropped
+        :type max_line_length: int
         """
         if not (self.__logfile_name or self.__pty_master):
             raise AttributeError("Logfile name or a Popen process is required.")
         self.__alive = True
 
         if self.__logfile_name:
-            self.__log_file = open(self.__logfile_name, 'rb')
+            self.__log = LogFile(self.__logfile_name, self.loop, checkpoint_file=checkpoint_file,
+                                 use_inotify=use_inotify, poll_interval=LOG_POLL_INTERVAL)
+            self.__log.open(skip_old=scan_old)
+            if (scan_tail is not None or scan_since) and not self.__log.resumed:
+                end = yield from self.__scan_history(scan_tail, scan_since, debug, max_batch)
+                self.__log.seek(end)
+        else:
+            self.__log = PtyLog(self.__pty_master, self.loop)
+            self.__log.open()
 
-        if self.__log_file and scan_old:
-            self.__log_file.readlines()
+        reconciler = None
+        if self.__rcon_password:
+            # Keeps the roster used for the chat security check right, without an rcon call per message
+            reconciler = asyncio.ensure_future(self.roster.keep_reconciled(self.loop), loop=self.loop)
 
-        buf = ''
+        splitter = LineSplitter(max_line_length)
         if realtime:
             while self.__alive:
-                try:
-                    buf += self._read_log()
-                    lines = buf.splitlines(True)
-                    line = ''
-                    for line in lines:
-                        if debug:
-                            print("[DPLib] %s" % line.strip())
-                        yield from self.__parse_line(line)
-                    if not line or line[-1] != '\n':
-                        buf = line
-                    else:
-                        buf = ''
-                    yield from asyncio.sleep(0.05)
-                except OSError as e:
-                    raise e
-
-        if self.__log_file:
-            self.__log_file.close()
-        if self.__pty_master:
-            os.close(self.__pty_master)
-
-    def _read_log(self):
-        if self.__log_file:
-            return self.__log_file.readline().decode('latin-1')
-        elif self.__pty_master:
-            r, w, x = select.select([self.__pty_master], [], [], 0.01)
-            if r:
-                return os.read(self.__pty_master, 1024).decode('latin-1')
+                data = self.__log.read(max_batch)
+                for line in splitter.feed(data):
+                    if debug:
+                        print("[DPLib] %s" % line.strip())
+                    yield from self.__parse_line(line)
+                self.__log.checkpoint(pending=splitter.pending)
+                if self.__log.eof:
+                    # The dp2 process is gone, nothing more will be logged
+                    self.__alive = False
+                elif len(data) < max_batch:
+                    yield from self.__log.wait()
+                else:
+                    # More data is pending, only let the other tasks run
+                    yield from asyncio.sleep(0)
+
+        if reconciler:
+            reconciler.cancel()
+        self.__log.checkpoint(pending=splitter.pending, force=True)
+        self.__log.close()
+        self.close_rcon()
+
+    def close_rcon(self):
+        """
+        Closes the rcon sockets, called when :func:`Server.start` ends. They're opened again when needed.
+        """
+        self.__rcon_socket.close()
+        if self.__rcon_client is not None:
+            self.__rcon_client.close()
+
+    @asyncio.coroutine
+    def __scan_history(self, scan_tail, scan_since, debug, max_batch):
+        """
+        Handles events already present in the logfile, walking it in place with :class:`dplib.logfile.LogScanner`.
+        Compressed logfiles can't be mapped, they're decompressed once with :func:`dplib.logfile.scan_compressed`.
+
+        :param scan_tail: Number of bytes from the end to scan
+        :param scan_since: Time (HH:MM:SS) to scan from
+        :param max_batch: Number of bytes handled before letting other tasks run
+
+        :return: Offset where the scan stopped
+        :rtype: int
+        """
+        if is_compressed(self.__logfile_name):
+            start, lines = scan_compressed(self.__logfile_name, tail=scan_tail, since=scan_since)
+            end = yield from self.__handle_history(start, lines, debug, max_batch)
+            return end
+        with LogScanner(self.__logfile_name) as scanner:
+            if scan_since:
+                start = scanner.offset_since(scan_since)
             else:
-                return ''
+                start = scanner.offset_of_tail(scan_tail)
+            end = yield from self.__handle_history(start, scanner.lines(start), debug, max_batch)
+        return end
+
+    @asyncio.coroutine
+    def __handle_history(self, start, lines, debug, max_batch):
+        """
+        Parses the lines found by :func:`Server.__scan_history`.
+
+        :param start: Offset of the first line
+        :param lines: Iterable of lines (bytes, with line endings)
+
+        :return: Offset after the last line
+        :rtype: int
+        """
+        end = start
+        batch = 0
+        for line in lines:
+            end += len(line)
+            batch += len(line)
+            line = line.decode('latin-1')
+            if debug:
+                print("[DPLib] %s" % line.strip())
+            yield from self.__parse_line(line)
+            if batch >= max_batch:
+                batch = 0
+                yield from asyncio.sleep(0)
+        return end
+
+    @asyncio.coroutine
+    def start_replay(self, logfile=None, debug=False, drain=3600):
+        """
+        Replays an archived log as fast as possible. Must be run on a :class:`dplib.replay.VirtualClockEventLoop`,
+        which is driven by the [HH:MM:SS] timestamps of the log, so timeouts behave the same as they did live.
+        Use :func:`Server.replay` unless you manage the event loop yourself.
+
+        While replaying, :func:`Server.rcon` and :func:`Server.status` don't send anything and return an empty string,
+        cvars are empty and the status has no players. Chat is taken from the players the roster saw entering,
+        or from lines that are nothing else.
+
+        :param logfile: Path to the archived log (can be compressed - .gz, .bz2, .xz), defaults to the server's logfile
+        :param debug: Print the replayed lines
+        :type debug: bool
+        :param drain: Seconds the clock is moved forward at the end of the log, so pending timeouts fire
+        :type drain: float
+        """
+        logfile = logfile or self.__logfile_name
+        if not logfile:
+            raise AttributeError("Logfile name is required.")
+        if not isinstance(self.loop, VirtualClockEventLoop):
+            raise TypeError('Replaying requires a VirtualClockEventLoop, use Server.replay')
+        self.__alive = True
+        self.__replaying = True
+        clock = LogClock()
+        try:
+            for line in iter_lines(logfile):
+                if not self.__alive:
+                    break
+                line = line.decode('latin-1')
+                when = clock(line)
+                if when is not None:
+                    yield from self.loop.advance_to(when)
+                if debug:
+                    print("[DPLib] %s" % line.strip())
+                yield from self.__parse_line(line)
+                # Let the handlers run before the clock moves on
+                yield from self.loop.settle()
+            yield from self.loop.advance_to(self.loop.time() + drain)
+        finally:
+            self.__replaying = False
+            self.__alive = False
+
+    def replay(self, logfile=None, debug=False, drain=3600):
+        """
+        Runs the handlers over an archived log at full speed, see :func:`Server.start_replay`.
+
+        :param logfile: Path to the archived log, defaults to the server's logfile
+        :param debug: Print the replayed lines
+        :type debug: bool
+        :param drain: Seconds the clock is moved forward at the end of the log, so pending timeouts fire
+        :type drain: float
+
+        :example:
+        .. code-block:: python
+            :linenos:
+
+            >>> from dplib.server import Server
+            >>> s = Server(hostname='127.0.0.1', logfile=r'qconsole27910.log')
+            >>> @s.event
+            ... def on_elim(killer_nick, killer_weapon, victim_nick, victim_weapon, suicide):
+            ...     print(killer_nick, victim_nick)
+            ...
+            >>> s.replay()
+            mRokita hTml
+        """
+        live_loop = self.loop
+        self.loop = VirtualClockEventLoop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.start_replay(logfile, debug, drain))
+        finally:
+            self.loop.close()
+            self.loop = live_loop
+            asyncio.set_event_loop(live_loop)
 
     def get_players(self):
         """
         Gets playerlist.
+        The sv players response is reused for :attr:`Server.roster`.ttl seconds (2 by default),
+        unless a player has entered the game since, leaves and name changes are applied to it.
 
         :return: List of :class:`.Player` instances
         :rtype: list
         """
-        response = self.rcon('sv players')
-        response = re.findall('(\d+) \\(?(.*?)\\)?\\] \\* (?:OP \d+, )?(.+) \\((b\d+)\\)', response)
-        players = list()
-        for p_data in response:
-            player = Player(nick=p_data[2],
-                            id=p_data[0],
-                            dplogin=p_data[1],
-                            build=p_data[3],
-                            server=self)
-            players.append(player)
-        return players
+        return self.roster.get_players()
+
+    def __fetch_players(self):
+        """
+        Gets playerlist from the server, bypassing the cache.
+
+        :return: List of (id, dplogin, nick, build) tuples, see :class:`.Player`
+        :rtype: list
+        """
+        return self.__parse_players(self.rcon('sv players'))
+
+    @asyncio.coroutine
+    def __async_fetch_players(self):
+        return self.__parse_players((yield from self.async_rcon('sv players')))
+
+    @staticmethod
+    def __parse_players(response):
+        return re.findall('(\d+) \\(?(.*?)\\)?\\] \\* (?:OP \d+, )?(.+) \\((b\d+)\\)', response)
+
+    @asyncio.coroutine
+    def async_get_players(self):
+        """
+        Gets playerlist without blocking the event loop, see :func:`Server.get_players`.
+        Concurrent calls share one sv players request.
+
+        :return: List of :class:`.Player` instances
+        :rtype: list
+        """
+        return (yield from self.roster.async_get_players(self.__async_fetch_players, self.loop))
 
     def get_simple_playerlist(self):
         """
@@ -1270,20 +1891,42 @@ class Server(object):
         :return: status dict
         :rtype: dict
         """
+        return self.__parse_status(self.status())
+
+    @asyncio.coroutine
+    def async_get_status(self):
+        """
+        Gets server status without blocking the event loop, see :func:`Server.get_status`.
+        Concurrent calls share one status query and get the same dict, don't modify it.
+
+        :return: status dict
+        :rtype: dict
+        """
+        return (yield from self.single_flight.do('status', self.__fetch_status))
+
+    @asyncio.coroutine
+    def __fetch_status(self):
+        return self.__parse_status((yield from self.async_status()))
+
+    def __parse_status(self, response):
         dictionary = {}
         players = []
-        response = self.status().split('\n')[1:]
+        if not response:
+            # Nothing is sent while replaying, see Server.status
+            dictionary['players'] = players
+            return dictionary
+        response = response.split('\n')[1:]
         variables = response[0]
         players_str = (response[1:])
-        for i in players_str:
-            if not i:
-                continue
+        # score ping "name", only the names are decoded so they can be cached, see :func:`dplib.parse.enable_cache`
+        separated = [i.split(' ', 2) for i in players_str if i]
+        names = decode_ingame_texts(name[1:-1] for score, ping, name in separated)
+        self.roster.update_status((name[1:-1], int(score), int(ping)) for score, ping, name in separated)
+        for (score, ping, name), cleaned_name in zip(separated, names):
             temp_dict = {}
-            cleaned_name = decode_ingame_text(i)
-            separated = cleaned_name.split(' ')
-            temp_dict['score'] = separated[0]
-            temp_dict['ping'] = separated[1]
-            temp_dict['name'] = cleaned_name.split("%s %s " % (separated[0], separated[1]))[1][1:-1]
+            temp_dict['score'] = score
+            temp_dict['ping'] = ping
+            temp_dict['name'] = cleaned_name
             players.append(temp_dict)
         dictionary['players'] = players
         variables = variables.split('\\')[1:]
@@ -1291,19 +1934,30 @@ class Server(object):
             dictionary[variables[i]] = variables[i + 1]
         return dictionary
 
-    def get_ingame_info(self, nick):
+    def get_ingame_info(self, nick=None, id=None, dplogin=None, name=None):
         """
-        Get ingame info about a player with nickname
+        Get ingame info about a player with nickname, or with id, dplogin.com account id or decoded nick.
+        Lookups use the indexes of :attr:`Server.roster`.
 
         :param nick: Nick
+        :param id: Player's id
+        :param dplogin: Player's dplogin.com account id
+        :param name: Nick without color codes, case insensitive
 
-        :return: An instance of :class:`.Player`
+        :return: An instance of :class:`.Player`, None if there's no such player
         """
-        players = self.get_players()
-        for p in players:
-            if p.nick == nick:
-                return p
-        return None
+        return self.roster.get_player(nick=nick, id=id, dplogin=dplogin, name=name)
+
+    @asyncio.coroutine
+    def async_get_ingame_info(self, nick=None, id=None, dplogin=None, name=None):
+        """
+        Get ingame info about a player without blocking the event loop, see :func:`Server.get_ingame_info`.
+        Concurrent calls share one sv players request.
+
+        :return: An instance of :class:`.Player`, None if there's no such player
+        """
+        return (yield from self.roster.async_get_player(self.__async_fetch_players, self.loop,
+                                                        nick=nick, id=id, dplogin=dplogin, name=name))
 
     def make_secure(self, timeout=10):
         """
@@ -1320,19 +1974,19 @@ class Server(object):
         start_time = time()
         while not (sl_logging_set and sv_blockednames_set) and time() - start_time < timeout:
             try:
-                if not sl_logging_set:
-                    sl_logging = self.get_cvar('sl_logging')
-                    if sl_logging != '1':
-                        self.set_cvar('sl_logging', '1')
-                    else:
-                        sl_logging_set = True
-                if not sv_blockednames_set:
-                    blockednames = self.get_cvar('sv_blockednames')
-
-                    if not 'maploaded' in blockednames:
-                        self.set_cvar('sv_blockednames', ','.join([blockednames, 'maploaded']))
-                    else:
-                        sv_blockednames_set = True
+                # Both cvars are read in one round-trip and set in another one
+                sl_logging, blockednames = self.get_cvars('sl_logging', 'sv_blockednames')
+                commands = []
+                if sl_logging != '1':
+                    commands.append('set sl_logging "1"')
+                else:
+                    sl_logging_set = True
+                if not 'maploaded' in blockednames:
+                    commands.append('set sv_blockednames "%s"' % ','.join([blockednames, 'maploaded']))
+                else:
+                    sv_blockednames_set = True
+                if commands:
+                    self.rcon_batch(commands)
             except ConnectionError or timeout:
                 pass
         if not (sl_logging_set and sv_blockednames_set):
@@ -1343,7 +1997,7 @@ class Server(object):
         else:
             self.__is_secure = True
 
-    def run(self, scan_old=False, realtime=True, debug=False, make_secure=True):
+    def run(self, scan_old=False, realtime=True, debug=False, make_secure=True, max_batch=LOG_MAX_BATCH):
         """
         Runs the main loop using asyncio.
 
@@ -1351,6 +2005,8 @@ class Server(object):
         :type scan_old: bool
         :param realtime: Wait for incoming logfile data
         :type realtime: bool
+        :param max_batch: Maximum number of bytes read from the log in one wakeup, see :func:`Server.start`
+        :type max_batch: int
         """
         if make_secure and not self.__rcon_password:
             raise AttributeError(
@@ -1361,4 +2017,122 @@ class Server(object):
                 "  make_secure=False")
         if make_secure:
             self.make_secure()
-        self.loop.run_until_complete(self.start(scan_old, realtime, debug))
+        self.loop.run_until_complete(self.start(scan_old, realtime, debug, max_batch))
+
+
+class ServerGroup(object):
+    """
+    Runs the main loops of many servers concurrently on one event loop, in one thread.
+
+    Logfiles are followed through one shared inotify instance and ptys are registered in the same loop,
+    so each line is handled by the :class:`Server` it belongs to as soon as it's written.
+
+    :param servers: Servers to run
+    :type servers: list
+    :param loop: Event loop, defaults to the current event loop
+
+    :example:
+    .. code-block:: python
+        :linenos:
+
+        >>> from dplib.server import Server, ServerGroup
+        >>> group = ServerGroup([
+        ...     Server(hostname='127.0.0.1', port=27910, logfile=r'qconsole27910.log', rcon_password='hello'),
+        ...     Server(hostname='127.0.0.1', port=27911, logfile=r'qconsole27911.log', rcon_password='hello'),
+        ... ])
+        >>> group.run()
+    """
+
+    def __init__(self, servers=(), loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.servers = []
+        self.__lock = Lock()
+        self.__kwargs = None
+        self.__tasks = set()
+        self.__keep_running = False
+        self.__finished = None
+        for server in servers:
+            self.add(server)
+
+    def add(self, server):
+        """
+        Adds a server to the group. If the group is already running, the server's main loop is started too.
+        Can be called from any thread.
+
+        :param server: An instance of :class:`Server`
+        """
+        server.loop = self.loop
+        with self.__lock:
+            self.servers.append(server)
+            if self.__kwargs is not None:
+                self.loop.call_soon_threadsafe(self.__start_server, server)
+
+    def __start_server(self, server):
+        if self.__kwargs is None:
+            # The group has ended in the meantime
+            return
+        task = asyncio.ensure_future(server.start(**self.__kwargs), loop=self.loop)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__server_stopped)
+
+    def __server_stopped(self, task):
+        self.__tasks.discard(task)
+        if self.__finished.done():
+            return
+        if not task.cancelled() and task.exception() is not None:
+            self.__finished.set_exception(task.exception())
+        elif not self.__tasks and not self.__keep_running:
+            self.__finished.set_result(None)
+
+    def __stop(self):
+        self.__keep_running = False
+        if not self.__tasks and self.__finished and not self.__finished.done():
+            self.__finished.set_result(None)
+
+    def stop_listening(self):
+        """
+        Stops the main loops of all servers, the group stops too when they end.
+        """
+        with self.__lock:
+            servers = list(self.servers)
+            if self.__kwargs is not None:
+                self.loop.call_soon_threadsafe(self.__stop)
+        for server in servers:
+            server.stop_listening()
+
+    @asyncio.coroutine
+    def start(self, keep_running=False, **kwargs):
+        """
+        Runs the main loops of all servers, see :func:`Server.start` for the arguments.
+        Ends when the main loops of all servers have ended.
+
+        :param keep_running: Keep running when there are no servers left, until :func:`ServerGroup.stop_listening`
+            is called. Use it to start the group first and add the servers later, e.g. from another thread.
+        :type keep_running: bool
+        """
+        self.__finished = asyncio.Future(loop=self.loop)
+        self.__keep_running = keep_running
+        with self.__lock:
+            self.__kwargs = kwargs
+            servers = list(self.servers)
+        for server in servers:
+            self.__start_server(server)
+        if not servers and not keep_running:
+            self.__finished.set_result(None)
+        try:
+            yield from self.__finished
+        finally:
+            with self.__lock:
+                self.__kwargs = None
+
+    def run(self, make_secure=True, **kwargs):
+        """
+        Runs the main loops of all servers using asyncio, see :func:`Server.start` for the arguments.
+
+        :param make_secure: Call :func:`Server.make_secure` on every server first
+        :type make_secure: bool
+        """
+        if make_secure:
+            for server in self.servers:
+                server.make_secure()
+        self.loop.run_until_complete(self.start(**kwargs))
@@ -45,8 +45,8 @@ def on_mapchange(mapname):
     if message:
         message = mapname.join(message.split('<mapname>'))
     if command:
-        for c in command.split(';'):
-            s.rcon(c)
+        # All the commands in one round-trip
+        s.rcon_batch([c for c in command.split(';') if c])
     if message:
         yield from sleep(3)
         s.say(message)
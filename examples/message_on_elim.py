@@ -25,7 +25,8 @@ spawnkill_last_times = dict()
 
 @s.event
 def on_elim(killer_nick, killer_weapon, victim_nick, victim_weapon):
-    s.say('{C}A%s sucks at DP' % escape_braces(victim_nick))
-    s.cprint('{C}A%s NOOB' % escape_braces(victim_nick))
+    # Chat is queued behind moderation and rate-limited, bursts of elims can't flood the server
+    yield from s.async_say('{C}A%s sucks at DP' % escape_braces(victim_nick))
+    yield from s.async_cprint('{C}A%s NOOB' % escape_braces(victim_nick))
 
 s.run()
\ No newline at end of file
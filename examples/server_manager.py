@@ -16,7 +16,7 @@ import aioftp
 
 from _socket import timeout
 
-from dplib.server import Server, ServerEvent
+from dplib.server import Server, ServerEvent, ServerGroup
 
 # -------------- BEGIN CONFIG SECTION ----------------
 
@@ -61,6 +61,9 @@ SERVERS = {
 
 managed_servers = dict()
 
+# Main loops of all the servers run on one asyncio loop, in one thread
+event_group = ServerGroup(loop=asyncio.new_event_loop())
+
 
 
 
@@ -105,8 +108,7 @@ class ManagedServer(Server):
         return self.pid is not None
 
     def start_event_service(self):
-        t = Thread(target=self.run, kwargs={'debug': True, 'make_secure': False})
-        t.start()
+        event_group.add(self)
 
     def get_event_handler(self, event_type):
         if event_type in self.handlers:
@@ -146,8 +148,10 @@ class ManagedServer(Server):
         )
         managed_servers[self.server_id] = self
         port = None
-        self.make_secure()
+        # The group's loop is already running and drains the pty from now on,
+        # so the server can't block on a full pty buffer while we're polling it
         self.start_event_service()
+        self.make_secure()
         while not port and time() - start_time < LAUNCH_TIMEOUT:
             try:
                 port = self.get_cvar('port')
@@ -220,6 +224,9 @@ class ManagedServer(Server):
 
 
 def run_servers():
+    # Servers added to the running group are started on its loop right away
+    t = Thread(target=event_group.run, kwargs={'debug': True, 'make_secure': False, 'keep_running': True})
+    t.start()
     for s in SERVERS:
         managed_server = ManagedServer(server_id=s, config=SERVERS[s])
         managed_server.start_process()
@@ -228,6 +235,7 @@ def run_servers():
 def kill_all():
     for s in list(managed_servers.values()):
         s.kill()
+    event_group.stop_listening()
 
 try:
     if __name__ == '__main__':
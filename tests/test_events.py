@@ -0,0 +1,48 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of :mod:`dplib.events`
+"""
+import unittest
+
+from dplib.events import make_event_class
+from dplib.server import Server
+
+
+class MakeEventClassTest(unittest.TestCase):
+    def test_mapping(self):
+        event_class = make_event_class('vote_passed', ('command',))
+        event = event_class.parse('map airtime', timestamp=10)
+        self.assertEqual(dict(**event), {'command': 'map airtime'})
+        self.assertEqual(event.type, 'vote_passed')
+        self.assertEqual(event.timestamp, 10)
+
+    def test_reserved_fields(self):
+        for name in ('keys', 'items', 'values', 'get', 'type', 'timestamp', 'parse', '__getitem__'):
+            with self.assertRaises(ValueError):
+                make_event_class('vote_passed', (name,))
+
+    def test_register_rejects_mapping_methods(self):
+        server = Server(hostname='127.0.0.1', init_vars=False)
+        for name in ('keys', 'get'):
+            with self.assertRaises(ValueError):
+                server.register_event('vote_' + name, 'Vote passed: (?P<%s>.*?)\\r?\\n' % name)
+            self.assertFalse(hasattr(server, 'on_vote_' + name))
+
+
+if __name__ == '__main__':
+    unittest.main()
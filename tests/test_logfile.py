@@ -0,0 +1,163 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of :mod:`dplib.logfile`
+"""
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from dplib.logfile import LineSplitter, LogFile, LogScanner, iter_lines, scan_compressed
+
+LINES = [
+    b'[23:59:58] hTml entered the game (build 41) [127.0.0.1:9419]\n',
+    b'[23:59:59] hTml: hi\n',
+    b'[00:00:01] hTml: after midnight\n',
+    b'no timestamp\n',
+    b'[00:00:05] hTml disconnected.\n',
+]
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, data, opener=open):
+        with opener(self.path(name), 'wb') as f:
+            f.write(data)
+        return self.path(name)
+
+
+class LineSplitterTest(unittest.TestCase):
+    def test_keeps_incomplete_line(self):
+        splitter = LineSplitter()
+        self.assertEqual(splitter.feed(b'[10:00:00] a\n[10:00'), ['[10:00:00] a\n'])
+        self.assertEqual(splitter.pending, len(b'[10:00'))
+        self.assertEqual(splitter.feed(b':01] b\n'), ['[10:00:01] b\n'])
+        self.assertEqual(splitter.pending, 0)
+
+    def test_drops_long_lines(self):
+        splitter = LineSplitter(max_line_length=10)
+        self.assertEqual(splitter.feed(b'x' * 20), [])
+        self.assertEqual(splitter.feed(b'xx\nok\n'), ['ok\n'])
+
+
+class LogFileCheckpointTest(LogTestCase):
+    def setUp(self):
+        super(LogFileCheckpointTest, self).setUp()
+        self.log = self.write('qconsole.log', b''.join(LINES[:2]))
+        self.checkpoint_file = self.path('checkpoint.json')
+
+    def read_all(self, **kwargs):
+        log = LogFile(self.log, checkpoint_file=self.checkpoint_file)
+        log.open(**kwargs)
+        data = log.read(1 << 16)
+        log.checkpoint(force=True)
+        log.close()
+        return log, data
+
+    def test_resumes(self):
+        self.read_all()
+        with open(self.log, 'ab') as f:
+            f.write(LINES[2])
+        log, data = self.read_all()
+        self.assertTrue(log.resumed)
+        self.assertEqual(data, LINES[2])
+
+    def test_rotated_file_not_resumed(self):
+        self.read_all()
+        os.rename(self.log, self.log + '.1')
+        # The same first lines, the hash alone would match
+        self.write('qconsole.log', b''.join(LINES[:3]))
+        log, data = self.read_all(skip_old=True)
+        self.assertFalse(log.resumed)
+        self.assertEqual(data, b'')
+
+    def test_rewritten_file_not_resumed(self):
+        self.read_all()
+        with open(self.log, 'r+b') as f:
+            f.seek(len(LINES[0]))
+            f.write(b'[00:00:00]')
+        log, data = self.read_all()
+        self.assertFalse(log.resumed)
+        self.assertEqual(data, LINES[0] + b'[00:00:00]' + LINES[1][10:])
+
+    def test_truncated_file_not_resumed(self):
+        self.read_all()
+        with open(self.log, 'r+b') as f:
+            f.truncate(5)
+        log, data = self.read_all(offset=0)
+        self.assertFalse(log.resumed)
+        self.assertEqual(data, LINES[0][:5])
+
+    def test_compressed(self):
+        self.log = self.write('qconsole.log.gz', b''.join(LINES), gzip.open)
+        log, data = self.read_all()
+        self.assertEqual(data, b''.join(LINES))
+        log, data = self.read_all()
+        self.assertTrue(log.resumed)
+        self.assertEqual(data, b'')
+
+
+class ScanTest(LogTestCase):
+    def setUp(self):
+        super(ScanTest, self).setUp()
+        data = b''.join(LINES) + b'[00:00:06] incompl'
+        self.plain = self.write('qconsole.log', data)
+        self.compressed = self.write('qconsole.log.gz', data, gzip.open)
+
+    def test_offset_since(self):
+        with LogScanner(self.plain) as scanner:
+            # Walking back stops at midnight
+            self.assertEqual(list(scanner.lines(scanner.offset_since('00:00:00'))), LINES[2:])
+            self.assertEqual(list(scanner.lines(scanner.offset_since('00:00:02'))), LINES[3:])
+
+    def test_offset_of_tail(self):
+        with LogScanner(self.plain) as scanner:
+            size = len(LINES[-1]) + len(b'[00:00:06] incompl')
+            self.assertEqual(list(scanner.lines(scanner.offset_of_tail(size))), LINES[-1:])
+
+    def test_compressed_matches_scanner(self):
+        with LogScanner(self.plain) as scanner:
+            for since in ('00:00:00', '00:00:02', '23:59:59', '12:00:00'):
+                start = scanner.offset_since(since)
+                lines = list(scanner.lines(start))
+                self.assertEqual(scan_compressed(self.compressed, since=since)[1], lines)
+            for tail in (0, 10, 40, 100, 1000):
+                start = scanner.offset_of_tail(tail)
+                self.assertEqual(scan_compressed(self.compressed, tail=tail)[1], list(scanner.lines(start)))
+            self.assertEqual(scan_compressed(self.compressed, tail=100)[0], scanner.offset_of_tail(100))
+        # Nothing selected, the scan ends after the last complete line
+        self.assertEqual(scan_compressed(self.compressed, tail=0), (len(b''.join(LINES)), []))
+
+    def test_compressed_not_mapped(self):
+        with self.assertRaises(ValueError):
+            LogScanner(self.compressed)
+
+    def test_iter_lines(self):
+        self.assertEqual(list(iter_lines(self.plain)), LINES)
+        self.assertEqual(list(iter_lines(self.compressed)), LINES)
+
+
+if __name__ == '__main__':
+    unittest.main()
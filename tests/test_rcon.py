@@ -0,0 +1,336 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of :mod:`dplib.rcon`, against a fake server answering on localhost
+"""
+import asyncio
+import socket
+import threading
+import time
+import unittest
+
+from dplib.rcon import BatchCollector, Priority, RconClient, RconScheduler, RconSocket, ResponseBuffer, \
+    SingleFlight, TokenBucket, PRINT_HEADER, batch_packets, rcon_packet
+
+PASSWORD = 'hello'
+
+
+class FakeServer(object):
+    """
+    Answers rcon packets like a DP server: echo prints its arguments, other commands print 'ok <command>'.
+    Commands listed in delays are answered after that many seconds, or never if the delay is None.
+    """
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.commands = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.__thread = threading.Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+
+    def __serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            _, password, command = data[4:].decode('latin-1').rstrip('\n').split(' ', 2)
+            self.commands.append(command)
+            if password != PASSWORD:
+                reply = PRINT_HEADER + b'Bad rcon_password.\n'
+            elif command.startswith('echo '):
+                reply = PRINT_HEADER + command[5:].encode('latin-1') + b' \n'
+            else:
+                reply = PRINT_HEADER + b'ok ' + command.encode('latin-1') + b'\n'
+            delay = self.delays.get(command, 0)
+            if delay is None:
+                continue
+            if delay:
+                threading.Timer(delay, self.__send, (reply, addr)).start()
+            else:
+                self.__send(reply, addr)
+
+    def __send(self, reply, addr):
+        try:
+            self.sock.sendto(reply, addr)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResponseBufferTest(unittest.TestCase):
+    def test_joins_packets_without_headers(self):
+        buffer = ResponseBuffer()
+        first = PRINT_HEADER + b'a' * 600
+        self.assertTrue(buffer.append(first))
+        self.assertFalse(buffer.append(PRINT_HEADER + b'b\n'))
+        self.assertEqual(buffer.getvalue(), str(first + b'b\n', 'latin-1'))
+
+    def test_short_packet_completes(self):
+        buffer = ResponseBuffer()
+        self.assertFalse(buffer.append(PRINT_HEADER + b'ok\n'))
+
+    def test_clear_keeps_memory(self):
+        buffer = ResponseBuffer(16)
+        buffer.append(PRINT_HEADER + b'x' * 2000)
+        size = len(buffer.data)
+        buffer.clear()
+        buffer.append(PRINT_HEADER + b'y\n')
+        self.assertEqual(buffer.getvalue(), str(PRINT_HEADER + b'y\n', 'latin-1'))
+        self.assertEqual(len(buffer.data), size)
+
+
+class BatchTest(unittest.TestCase):
+    def test_packets_and_markers(self):
+        packets, markers = batch_packets(PASSWORD, ['set elim 10', 'set timelimit 10'])
+        self.assertEqual(len(packets), 4)
+        self.assertEqual(packets[0], rcon_packet(PASSWORD, 'set elim 10'))
+        self.assertEqual(packets[1], rcon_packet(PASSWORD, 'echo %s' % markers[0].decode()))
+        self.assertNotEqual(markers[0], markers[1])
+
+    def test_command_too_long(self):
+        with self.assertRaises(ValueError):
+            batch_packets(PASSWORD, ['say ' + 'x' * 2000])
+
+    def test_collector_splits_at_markers(self):
+        collector = BatchCollector([b'm0', b'm1'])
+        self.assertFalse(collector.add(PRINT_HEADER + b'first\n'))
+        self.assertFalse(collector.add(PRINT_HEADER + b'm0 \n'))
+        self.assertFalse(collector.add(PRINT_HEADER + b'second\n'))
+        self.assertTrue(collector.add(PRINT_HEADER + b'm1 \n'))
+        self.assertEqual(collector.responses, [str(PRINT_HEADER + b'first\n', 'latin-1'),
+                                               str(PRINT_HEADER + b'second\n', 'latin-1')])
+
+    def test_collector_bad_password(self):
+        collector = BatchCollector([b'm0', b'm1'])
+        reply = PRINT_HEADER + b'Bad rcon_password.\n'
+        self.assertTrue(collector.add(reply))
+        self.assertTrue(collector.bad_password)
+        self.assertEqual(collector.responses, [str(reply, 'latin-1')] * 2)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(10, 2, self.clock)
+
+    def test_delay_and_refill(self):
+        self.assertEqual(self.bucket.delay(), 0)
+        self.bucket.take(2)
+        self.assertAlmostEqual(self.bucket.delay(), 0.1)
+        self.clock.now = 0.1
+        self.assertEqual(self.bucket.delay(), 0)
+        self.clock.now = 10
+        self.assertEqual(self.bucket.tokens, 2)
+
+    def test_cost_capped_at_capacity(self):
+        self.assertEqual(self.bucket.delay(5), 0)
+        self.bucket.take(5)
+        self.assertEqual(self.bucket.tokens, 0)
+
+
+class RconSocketTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer()
+        self.addCleanup(self.server.close)
+        self.sock = RconSocket('127.0.0.1', self.server.port)
+        self.addCleanup(self.sock.close)
+
+    def test_query(self):
+        response = self.sock.query(rcon_packet(PASSWORD, 'sv players'))
+        self.assertEqual(response, '\xff\xff\xff\xffprint\nok sv players\n')
+
+    def test_batch(self):
+        packets, markers = batch_packets(PASSWORD, ['a', 'b'])
+        self.assertEqual(self.sock.batch(packets, markers),
+                         ['\xff\xff\xff\xffprint\nok a\n', '\xff\xff\xff\xffprint\nok b\n'])
+
+    def test_batch_bad_password(self):
+        packets, markers = batch_packets('wrong', ['a', 'b', 'c'])
+        start = time.monotonic()
+        responses = self.sock.batch(packets, markers, timeout=2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(responses, ['\xff\xff\xff\xffprint\nBad rcon_password.\n'] * 3)
+        self.assertEqual(self.sock.query(rcon_packet(PASSWORD, 'x')), '\xff\xff\xff\xffprint\nok x\n')
+
+    def test_timeout(self):
+        self.server.delays['hang'] = None
+        with self.assertRaises(socket.timeout):
+            self.sock.query(rcon_packet(PASSWORD, 'hang'), timeout=0.2)
+        self.assertEqual(self.sock.query(rcon_packet(PASSWORD, 'x')), '\xff\xff\xff\xffprint\nok x\n')
+
+
+class AsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_coroutine(self, coroutine, timeout=5):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, timeout, loop=self.loop))
+
+    @asyncio.coroutine
+    def gather(self, *coroutines):
+        return (yield from asyncio.gather(*coroutines, loop=self.loop))
+
+
+class RconClientTest(AsyncTestCase):
+    def setUp(self):
+        super(RconClientTest, self).setUp()
+        self.server = FakeServer()
+        self.addCleanup(self.server.close)
+        self.client = RconClient('127.0.0.1', self.server.port, PASSWORD, self.loop)
+        self.addCleanup(self.client.close)
+
+    def test_rcon(self):
+        response = self.run_coroutine(self.client.rcon('sv players'))
+        self.assertEqual(response, '\xff\xff\xff\xffprint\nok sv players\n')
+        self.assertTrue(self.client.connected)
+
+    def test_concurrent_requests_dont_mix(self):
+        self.server.delays['slow'] = 0.2
+        responses = self.run_coroutine(self.gather(self.client.rcon('slow'), self.client.rcon('fast')))
+        self.assertEqual(responses, ['\xff\xff\xff\xffprint\nok slow\n', '\xff\xff\xff\xffprint\nok fast\n'])
+
+    def test_timeout(self):
+        self.server.delays['late'] = 0.3
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_coroutine(self.client.rcon('late', timeout=0.1))
+        # The late response to the request that timed out isn't taken for this one
+        response = self.run_coroutine(self.client.rcon('next'))
+        self.assertEqual(response, '\xff\xff\xff\xffprint\nok next\n')
+
+    def test_batch(self):
+        responses = self.run_coroutine(self.client.batch(['a', 'b']))
+        self.assertEqual(responses, ['\xff\xff\xff\xffprint\nok a\n', '\xff\xff\xff\xffprint\nok b\n'])
+
+
+class RconSchedulerTest(AsyncTestCase):
+    def setUp(self):
+        super(RconSchedulerTest, self).setUp()
+        self.scheduler = RconScheduler(rate=1000, burst=1000, loop=self.loop)
+        self.order = []
+
+    def request(self, name, duration=0):
+        @asyncio.coroutine
+        def send():
+            self.order.append(name)
+            yield from asyncio.sleep(duration, loop=self.loop)
+            return name
+        return send
+
+    def test_priority_order(self):
+        @asyncio.coroutine
+        def submit_all():
+            # The first request keeps the queue busy while the others are queued
+            first = asyncio.ensure_future(self.scheduler.submit(self.request('first', 0.05)), loop=self.loop)
+            yield from asyncio.sleep(0, loop=self.loop)
+            results = yield from asyncio.gather(
+                self.scheduler.submit(self.request('chat'), Priority.CHAT),
+                self.scheduler.submit(self.request('query'), Priority.QUERY),
+                self.scheduler.submit(self.request('kick'), Priority.MODERATION),
+                first, loop=self.loop)
+            return results
+        self.assertEqual(self.run_coroutine(submit_all()), ['chat', 'query', 'kick', 'first'])
+        self.assertEqual(self.order, ['first', 'kick', 'query', 'chat'])
+
+    def test_moderation_doesnt_wait_for_query(self):
+        @asyncio.coroutine
+        def kick_behind_query():
+            query = asyncio.ensure_future(self.scheduler.submit(self.request('query', 1)), loop=self.loop)
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            start = self.loop.time()
+            yield from self.scheduler.submit(self.request('kick'), Priority.MODERATION)
+            waited = self.loop.time() - start
+            query.cancel()
+            return waited
+        self.assertLess(self.run_coroutine(kick_behind_query()), 0.5)
+
+    def test_cancel_stops_request(self):
+        cancelled = []
+
+        @asyncio.coroutine
+        def hang():
+            try:
+                yield from asyncio.sleep(10, loop=self.loop)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        @asyncio.coroutine
+        def cancel_then_query():
+            task = asyncio.ensure_future(self.scheduler.submit(hang), loop=self.loop)
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            task.cancel()
+            start = self.loop.time()
+            result = yield from self.scheduler.submit(self.request('next'))
+            return result, self.loop.time() - start
+        result, waited = self.run_coroutine(cancel_then_query())
+        self.assertEqual(result, 'next')
+        self.assertLess(waited, 0.5)
+        self.assertEqual(cancelled, [True])
+
+    def test_exception_reaches_caller(self):
+        @asyncio.coroutine
+        def fail():
+            raise OSError('unreachable')
+        with self.assertRaises(OSError):
+            self.run_coroutine(self.scheduler.submit(fail))
+
+    def test_rate_limit(self):
+        self.scheduler = RconScheduler(rate=20, burst=1, loop=self.loop)
+        start = self.loop.time()
+        self.run_coroutine(self.gather(*[self.scheduler.submit(self.request(i)) for i in range(5)]))
+        self.assertGreaterEqual(self.loop.time() - start, 0.15)
+        metrics = self.scheduler.metrics()
+        self.assertEqual(metrics['query']['sent'], 5)
+        self.assertEqual(metrics['queued'], 0)
+        self.assertEqual(metrics['in_flight'], 0)
+
+
+class SingleFlightTest(AsyncTestCase):
+    def test_shares_request(self):
+        flights = SingleFlight(self.loop)
+        calls = []
+
+        @asyncio.coroutine
+        def request():
+            calls.append(1)
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            return object()
+
+        results = self.run_coroutine(self.gather(flights.do('status', request), flights.do('status', request)))
+        self.assertIs(results[0], results[1])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((flights.started, flights.shared), (1, 1))
+        self.run_coroutine(flights.do('status', request))
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
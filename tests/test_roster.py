@@ -0,0 +1,169 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of :mod:`dplib.roster`
+"""
+import asyncio
+import unittest
+
+from dplib.events import DisconnectEvent, ElimEvent, EntranceEvent, NameChangeEvent, RespawnEvent, \
+    TeamSwitchedEvent
+from dplib.roster import Roster, normalize_nick
+
+PLAYERS = [('0', '123', 'hTml', 'b41'), ('1', '', '\x88Abob', 'b41')]
+
+
+class Fetch(object):
+    """
+    Stands for sv players, counting the calls.
+    """
+
+    def __init__(self, players=PLAYERS):
+        self.players = list(players)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return list(self.players)
+
+
+class RosterTest(unittest.TestCase):
+    def setUp(self):
+        self.fetch = Fetch()
+        self.roster = Roster(self.fetch, ttl=60)
+
+    def test_lookups(self):
+        player = self.roster.get_player(nick='hTml')
+        self.assertEqual((player.id, player.dplogin), ('0', '123'))
+        self.assertIs(self.roster.get_player(id=0), player)
+        self.assertIs(self.roster.get_player(dplogin=123), player)
+        self.assertIs(self.roster.get_player(name='BOB'), self.roster.get_player(nick='\x88Abob'))
+        self.assertIsNone(self.roster.get_player(nick='nobody'))
+        with self.assertRaises(TypeError):
+            self.roster.get_player()
+
+    def test_normalize_nick(self):
+        self.assertEqual(normalize_nick(' \x88ABob '), 'bob')
+
+    def test_cached_until_entrance(self):
+        self.roster.get_players()
+        self.roster.get_players()
+        self.assertEqual(self.fetch.calls, 1)
+        self.roster.handle_event(EntranceEvent('rob', '41', '127.0.0.1:1'))
+        self.assertIn('rob', self.roster)
+        self.roster.get_players()
+        self.assertEqual(self.fetch.calls, 2)
+
+    def test_players_kept_across_polls(self):
+        player = self.roster.get_player(nick='hTml')
+        self.roster.invalidate()
+        self.assertIs(self.roster.get_player(nick='hTml'), player)
+        self.assertEqual(self.fetch.calls, 2)
+
+    def test_events(self):
+        player = self.roster.get_player(nick='hTml')
+        self.roster.handle_event(TeamSwitchedEvent('hTml', 'Observer', 'Red'))
+        self.assertEqual((player.team, player.alive), ('Red', False))
+        self.roster.handle_event(RespawnEvent('Red', 'hTml'))
+        self.assertTrue(player.alive)
+        self.roster.handle_event(ElimEvent('\x88Abob', 'PGP', 'hTml', 'Spyder', ''))
+        self.assertFalse(player.alive)
+        self.roster.handle_event(NameChangeEvent('hTml', 'mRokita'))
+        self.assertIs(self.roster.get_player(nick='mRokita'), player)
+        self.assertIsNone(self.roster.get_player(nick='hTml'))
+        self.assertEqual(self.roster.nicks, {'mRokita', '\x88Abob'})
+        self.roster.handle_event(DisconnectEvent('mRokita'))
+        self.assertIsNone(self.roster.get_player(id=0))
+        self.assertNotIn('mRokita', self.roster)
+
+    def test_update_status(self):
+        self.roster.get_players()
+        self.roster.update_status([('hTml', 5, 30), ('nobody', 1, 1)])
+        player = self.roster.get_player(nick='hTml')
+        self.assertEqual((player.score, player.ping), (5, 30))
+
+    def test_check_throttled(self):
+        self.assertTrue(self.roster.check('hTml'))
+        self.assertEqual(self.fetch.calls, 1)
+        self.assertFalse(self.roster.check('fake'))
+        self.assertFalse(self.roster.check('fake'))
+        self.assertEqual(self.fetch.calls, 1)
+
+    def test_check_fetch_error(self):
+        def fail():
+            raise OSError('timed out')
+        roster = Roster(fail)
+        self.assertFalse(roster.check('hTml'))
+
+
+class AsyncRosterTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.fetch = Fetch()
+        self.roster = Roster(self.fetch, ttl=60)
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5, loop=self.loop))
+
+    def slow_fetch(self, events=()):
+        @asyncio.coroutine
+        def fetch():
+            self.fetch.calls += 1
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            for event in events:
+                self.roster.handle_event(event)
+            return list(self.fetch.players)
+        return fetch
+
+    @asyncio.coroutine
+    def gather(self, *coroutines):
+        return (yield from asyncio.gather(*coroutines, loop=self.loop))
+
+    def test_concurrent_reconciliations_shared(self):
+        fetch = self.slow_fetch()
+        self.run_coroutine(self.gather(self.roster.reconcile_async(fetch, self.loop),
+                                       self.roster.async_get_players(fetch, self.loop)))
+        self.assertEqual(self.fetch.calls, 1)
+        self.assertEqual(self.roster.nicks, {'hTml', '\x88Abob'})
+
+    def test_events_during_reconciliation_applied(self):
+        fetch = self.slow_fetch([DisconnectEvent('hTml')])
+        self.run_coroutine(self.roster.reconcile_async(fetch, self.loop))
+        self.assertEqual(self.roster.nicks, {'\x88Abob'})
+
+    def test_async_get_player(self):
+        player = self.run_coroutine(self.roster.async_get_player(self.slow_fetch(), self.loop, nick='hTml'))
+        self.assertEqual(player.id, '0')
+        self.assertIsNone(self.run_coroutine(self.roster.async_get_player(self.slow_fetch(), self.loop, id=5)))
+        self.assertEqual(self.fetch.calls, 1)
+
+    def test_async_check(self):
+        fetch = self.slow_fetch()
+        self.assertTrue(self.run_coroutine(self.roster.async_check(['hTml'], fetch, self.loop)))
+        self.assertFalse(self.run_coroutine(self.roster.async_check(['fake'], fetch, self.loop)))
+        self.assertEqual(self.fetch.calls, 1)
+
+    def test_async_check_timeout(self):
+        @asyncio.coroutine
+        def fetch():
+            raise asyncio.TimeoutError()
+        self.assertFalse(self.run_coroutine(self.roster.async_check(['hTml'], fetch, self.loop)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# DPLib - Asynchronous bot framework for Digital Paint: Paintball 2 servers
+# Copyright (C) 2017  Michał Rokita
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of :mod:`dplib.server`
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dplib.analyze import Stats
+from dplib.server import REGEXPS, Server, ServerEvent, parse_line
+from tests.test_rcon import FakeServer, PASSWORD
+
+
+class ParseLineTest(unittest.TestCase):
+    def test_map_loaded_not_chat(self):
+        events = parse_line('[10:20:11] == Map Loaded: airtime ==\n')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].type, ServerEvent.MAPCHANGE)
+        self.assertEqual(events[0].mapname, 'airtime')
+
+    def test_unverified_chat(self):
+        events = parse_line('[10:20:11] hTml: hi\n')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].type, ServerEvent.CHAT)
+        self.assertEqual((events[0].nick, events[0].message), ('hTml', 'hi'))
+
+    def test_rejected_chat_dropped(self):
+        events = parse_line('[10:20:11] hTml: hi\n', nicks_valid=lambda nick: False)
+        self.assertEqual(events, [])
+
+    def test_map_loaded_with_validation(self):
+        events = parse_line('[10:20:11] == Map Loaded: airtime ==\n', nicks_valid=lambda nick: False)
+        self.assertEqual([event.type for event in events], [ServerEvent.MAPCHANGE])
+
+    def test_regexps(self):
+        line = '[10:20:11] == Map Loaded: airtime ==\n'
+        # Whole line patterns, like before the keyword dispatch
+        matches = [(event_type, regexp.findall(line)) for regexp, event_type in REGEXPS.items() if regexp.match(line)]
+        self.assertEqual(matches, [(ServerEvent.CHAT, [('== Map Loaded', 'airtime ==')]),
+                                   (ServerEvent.MAPCHANGE, ['airtime'])])
+
+
+class AnalyzeTest(unittest.TestCase):
+    def test_map_counted(self):
+        stats = Stats()
+        for line in ('[10:20:11] == Map Loaded: airtime ==\n', '[10:20:12] hTml: hi\n'):
+            for event in parse_line(line):
+                stats.add(event)
+        self.assertEqual(dict(stats.maps), {'airtime': 1})
+        self.assertEqual(list(stats.players), ['hTml'])
+        self.assertEqual(stats.players['hTml'].messages, 1)
+
+
+class ReplayTest(unittest.TestCase):
+    LOG = (
+        '[10:20:10] hTml entered the game (build 41) [127.0.0.1:9419]\n'
+        '[10:20:11] == Map Loaded: airtime ==\n'
+        '[10:20:12] hTml: hi\n'
+        '[10:20:13] hTml: == Map Loaded: fake ==\n'
+        '[10:20:14] mRokita: hello\n'
+    )
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'qconsole27910.log')
+        with open(self.path, 'w') as f:
+            f.write(self.LOG)
+        self.server = Server(hostname='127.0.0.1', logfile=self.path, init_vars=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_events(self):
+        seen = []
+
+        @self.server.event
+        def on_mapchange(mapname):
+            seen.append(('map', mapname))
+
+        @self.server.event
+        def on_chat(nick, message):
+            seen.append(('chat', nick, message))
+
+        self.server.replay()
+        self.assertEqual(seen, [
+            ('map', 'airtime'),
+            ('chat', 'hTml', 'hi'),
+            # A known player's chat isn't taken for an event
+            ('chat', 'hTml', '== Map Loaded: fake =='),
+            # Not seen entering, but the line is nothing else
+            ('chat', 'mRokita', 'hello'),
+        ])
+
+    def test_nothing_sent(self):
+        responses = []
+
+        @self.server.event
+        def on_mapchange(mapname):
+            responses.append(self.server.status())
+            responses.append(self.server.get_cvar('elim'))
+            responses.append(self.server.get_status())
+
+        self.server.replay()
+        self.assertEqual(responses, ['', '', {'players': []}])
+
+    def test_nicks_valid(self):
+        results = []
+
+        @self.server.event
+        def on_mapchange(mapname):
+            results.append(self.server.nicks_valid('hTml'))
+            results.append(self.server.nicks_valid('hTml', 'nobody'))
+
+        self.server.replay()
+        self.assertEqual(results, [True, False])
+
+
+class PtyTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_start_ends_with_process(self):
+        master, slave = os.openpty()
+        os.write(slave, b'[10:20:11] == Map Loaded: airtime ==\n')
+        server = Server(hostname='127.0.0.1', pty_master=master, init_vars=False)
+        server.loop = self.loop
+        maps = []
+
+        @server.event
+        def on_mapchange(mapname):
+            maps.append(mapname)
+
+        # The dp2 process exits
+        self.loop.call_later(0.1, os.close, slave)
+        self.loop.run_until_complete(asyncio.wait_for(server.start(), 5, loop=self.loop))
+        self.assertEqual(maps, ['airtime'])
+        self.assertFalse(server.is_listening())
+
+
+class BlockingRconTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeServer()
+        self.addCleanup(self.fake.close)
+        self.server = Server(hostname='127.0.0.1', port=self.fake.port, rcon_password=PASSWORD, init_vars=False,
+                             rcon_rate=1, rcon_burst=1)
+        self.addCleanup(self.server.close_rcon)
+
+    def test_not_rate_limited(self):
+        start = time.monotonic()
+        for i in range(3):
+            self.server.say('hi %d' % i)
+        # Sleeping for the rate limit would stall the event loop the handlers run on
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.fake.commands, ['say "hi %d"' % i for i in range(3)])
+
+
+if __name__ == '__main__':
+    unittest.main()